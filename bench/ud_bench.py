@@ -0,0 +1,336 @@
+"""
+Benchmarks the download engine end to end against a local HTTP server, without touching YouTube.
+Synthetic clips are generated with ffmpeg and served as direct URLs (yt-dlp's generic extractor).
+Every scenario (concurrency x codec x encode mode) runs src/ud_cli.py in a fresh process and is
+measured from its JSON events: jobs/minute, bytes/s, encode fps, per-stage latency, CPU time and
+peak RSS (including ffmpeg). The thumbnail path is timed separately in process. Results are written
+as one JSON report; pass --compare with an earlier report to see the change per scenario.
+
+    python bench/ud_bench.py -o report.json
+    python bench/ud_bench.py --jobs 1,4 --codecs H.264 --encode-modes standard,segmented --compare report.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import statistics
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+sys.path.insert(0, SRC)
+
+from ud_engine import ENCODE_STANDARD, ENCODE_MODES, ENCODER_PROFILES, PROFILE_BALANCED, VIDEO_ENCODERS, YTDL_SESSION, DownloadJob, get_ffmpeg_path  # noqa: E402
+
+CHUNK_SIZE = 64 * 1024
+CLIP_FPS = 30
+# status -> stage that ends when a job reports it, for jobs moving through the scheduler in order
+STAGE_ENDS = {
+    'running': 'queue_wait',
+    'waiting': 'download',
+    'processing': 'encoder_wait',
+}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the download engine against a local media server.")
+    parser.add_argument("-o", "--output", default="bench_report.json", help="Report file")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "ud_bench"),
+                        help="Where generated clips are cached and jobs save their output")
+    parser.add_argument("--clips", type=int, default=6, help="Clips downloaded per scenario")
+    parser.add_argument("--duration", type=int, default=20, help="Clip length in seconds")
+    parser.add_argument("--size", default="1280x720", help="Clip resolution")
+    parser.add_argument("--jobs", default="1,3", help="Comma separated concurrency levels")
+    parser.add_argument("--codecs", default="Original,H.264", help="Comma separated output codecs")
+    parser.add_argument("--encode-modes", default=ENCODE_STANDARD, help="Comma separated encode modes")
+    parser.add_argument("--profile", default=PROFILE_BALANCED, choices=ENCODER_PROFILES,
+                        help="Encoder profile of all scenarios, compare reports to weigh profiles against each other")
+    parser.add_argument("--rate", type=int, default=0,
+                        help="Bandwidth cap per connection in bytes/s, to emulate a remote server (0: unlimited)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Delay before each response in seconds, to emulate a distant server")
+    parser.add_argument("--thumbnail-runs", type=int, default=20, help="Iterations of the thumbnail benchmark")
+    parser.add_argument("--compare", help="Earlier report to compare with")
+    return parser.parse_args(argv)
+
+class MediaServer:
+    """
+    Threaded static file server on a free local port that counts the bytes it sends and can cap
+    the rate of each connection and delay each response, like a distant server.
+    """
+    def __init__(self, directory, rate=0, latency=0.0):
+        self.rate = rate
+        self.latency = latency
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(SimpleHTTPRequestHandler):
+            def send_head(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                return super().send_head()
+
+            def copyfile(self, source, outputfile):
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    try:
+                        outputfile.write(chunk)
+                    except ConnectionError:
+                        return  # yt-dlp's generic extractor only reads the start of a file while probing
+                    with server.lock:
+                        server.bytes_sent += len(chunk)
+                    if server.rate:
+                        time.sleep(len(chunk) / server.rate)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), partial(Handler, directory=directory))
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+        threading.Thread(target=self.httpd.serve_forever, name="media-server", daemon=True).start()
+
+    def take_bytes_sent(self):
+        with self.lock:
+            sent, self.bytes_sent = self.bytes_sent, 0
+        return sent
+
+    def close(self):
+        self.httpd.shutdown()
+
+def generate_media(media_dir, clips, duration, size):
+    """
+    Generates MPEG-4 Part 2/AAC test clips (each with a different tone, so no two files are equal),
+    a cover image and an mp3 for the thumbnail benchmark. Existing files are reused. The clips use
+    a codec none of the encoders targets, so every codec scenario actually re-encodes them.
+    """
+    os.makedirs(media_dir, exist_ok=True)
+    ffmpeg = get_ffmpeg_path("ffmpeg")
+    names = []
+    for i in range(clips):
+        name = f"clip_{size}_{duration}s_{i}_mpeg4.mp4"
+        path = os.path.join(media_dir, name)
+        if not os.path.exists(path):
+            subprocess.run([
+                ffmpeg, "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={CLIP_FPS}:duration={duration}",
+                "-f", "lavfi", "-i", f"sine=frequency={220 + 40 * i}:duration={duration}",
+                "-c:v", "mpeg4", "-q:v", "3", "-g", str(2 * CLIP_FPS), "-c:a", "aac",
+                "-shortest", "-y", path
+            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        names.append(name)
+    extras = {
+        "cover.jpg": ["-f", "lavfi", "-i", "testsrc2=size=1280x720", "-frames:v", "1"],
+        "track.mp3": ["-f", "lavfi", "-i", "sine=duration=30", "-c:a", "libmp3lame"],
+    }
+    for name, args in extras.items():
+        path = os.path.join(media_dir, name)
+        if not os.path.exists(path):
+            subprocess.run([ffmpeg, *args, "-y", path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return names
+
+def summarize(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'mean': round(statistics.fmean(values), 4),
+        'p50': round(values[len(values) // 2], 4),
+        'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 4),
+        'max': round(values[-1], 4),
+    }
+
+def run_cli(cli_args):
+    """
+    Runs ud_cli.py and returns its parsed JSON events, exit code and resource usage. Resource usage
+    covers the CLI and the ffmpeg processes it waited for; it is None where os.wait4 is missing.
+    """
+    process = subprocess.Popen([sys.executable, os.path.join(SRC, "ud_cli.py"), *cli_args],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    events = [json.loads(line) for line in process.stdout if line.startswith("{")]
+    if hasattr(os, "wait4"):
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    else:
+        rusage = None
+        process.wait()
+    return events, process.returncode, rusage
+
+def stage_latencies(events):
+    """
+    Returns {stage: [seconds per job]} from the status events of each job.
+    """
+    stages = {}
+    last_change = {}  # job id -> time of its last status
+    post_processed = set()
+    for event in events:
+        job = event.get('job')
+        if event['event'] == 'added':
+            last_change[job] = event['time']
+        elif event['event'] == 'status' and job in last_change:
+            status = event['status']
+            if status in ('done', 'failed'):
+                # Jobs that needed no post-processing finish straight from the download stage
+                stage = 'postprocess' if job in post_processed else 'download'
+            else:
+                stage = STAGE_ENDS.get(status)
+                if status == 'processing':
+                    post_processed.add(job)
+            if stage:
+                stages.setdefault(stage, []).append(event['time'] - last_change[job])
+            last_change[job] = event['time']
+    return stages
+
+def run_scenario(server, clip_names, work_dir, jobs, codec, encode_mode, profile, duration):
+    output_dir = tempfile.mkdtemp(prefix="run_", dir=work_dir)
+    try:
+        cli_args = ["--no-archive", "-o", output_dir, "-c", codec, "--encode-mode", encode_mode,
+                    "--profile", profile, "-j", str(jobs), "--per-host", str(jobs)]
+        for name in clip_names:
+            cli_args += ["-u", server.base_url + name]
+        server.take_bytes_sent()
+        start = time.monotonic()
+        events, returncode, rusage = run_cli(cli_args)
+        wall = time.monotonic() - start
+        bytes_sent = server.take_bytes_sent()
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    summary = next((e for e in events if e['event'] == 'summary'), {})
+    stages = stage_latencies(events)
+    # Only jobs that actually ran an encode count; a stream copy or remux reports no 'reencode' stage
+    encode_times = [e['stages']['reencode'] for e in events if e['event'] == 'metrics' and 'reencode' in e['stages']]
+    encoded_frames = len(encode_times) * duration * CLIP_FPS
+    encode_time = sum(encode_times)
+    result = {
+        'name': f"jobs={jobs} codec={codec} mode={encode_mode}",
+        'jobs': jobs,
+        'codec': codec,
+        'encode_mode': encode_mode,
+        'exit_code': returncode,
+        'succeeded': summary.get('succeeded'),
+        'failed': summary.get('failed'),
+        'wall_seconds': round(wall, 3),
+        'jobs_per_minute': round(len(clip_names) / wall * 60, 2),
+        'bytes_per_second': round(bytes_sent / wall),
+        'bytes_downloaded': bytes_sent,
+        # Frames over the time spent in the re-encode stage of the jobs that ran one
+        'encode_fps': round(encoded_frames / encode_time, 1) if encoded_frames and encode_time else None,
+        'stages': {stage: summarize(values) for stage, values in stages.items()},
+    }
+    if rusage is not None:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        result['peak_rss_bytes'] = rusage.ru_maxrss * scale
+        result['cpu_seconds'] = round(rusage.ru_utime + rusage.ru_stime, 3)
+    return result
+
+def run_thumbnail_benchmark(server, media_dir, work_dir, runs):
+    """
+    Times the three steps of the thumbnail path (fetch over HTTP, resize in memory, embed into an mp3).
+    """
+    job = DownloadJob(server.base_url, work_dir, "bestaudio", "Original", download_thumbnail=True)
+    job.on_log = lambda msg: None
+    target = os.path.join(work_dir, "thumbnail_target.mp3")
+    timings = {'fetch': [], 'prepare': [], 'embed': []}
+    info = {'thumbnails': [{'url': server.base_url + "cover.jpg"}]}
+    with YTDL_SESSION.open({'quiet': True}) as ydl:
+        for _ in range(runs):
+            shutil.copy(os.path.join(media_dir, "track.mp3"), target)
+            start = time.perf_counter()
+            data = job.fetch_thumbnail(ydl, info)
+            fetched = time.perf_counter()
+            cover = job.prepare_thumbnail(data)
+            prepared = time.perf_counter()
+            job.embed_thumbnail(target, cover)
+            embedded = time.perf_counter()
+            timings['fetch'].append(fetched - start)
+            timings['prepare'].append(prepared - fetched)
+            timings['embed'].append(embedded - prepared)
+    os.remove(target)
+    return {step: summarize(values) for step, values in timings.items()}
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        ffmpeg_version = subprocess.run([get_ffmpeg_path("ffmpeg"), "-version"],
+                                        capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg_version = None
+    from yt_dlp.version import __version__ as yt_dlp_version
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'yt_dlp': yt_dlp_version,
+        'ffmpeg': ffmpeg_version,
+    }
+
+def compare(report, baseline):
+    """
+    Prints the relative change of the headline metrics of scenarios present in both reports.
+    """
+    previous = {s['name']: s for s in baseline.get('scenarios', [])}
+    for scenario in report['scenarios']:
+        old = previous.get(scenario['name'])
+        if not old:
+            continue
+        changes = []
+        for metric in ('jobs_per_minute', 'bytes_per_second', 'encode_fps', 'peak_rss_bytes', 'cpu_seconds'):
+            if scenario.get(metric) and old.get(metric):
+                changes.append(f"{metric} {(scenario[metric] / old[metric] - 1) * 100:+.1f}%")
+        print(f"{scenario['name']}: {', '.join(changes)}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    media_dir = os.path.join(args.work_dir, "media")
+    print("Generating media...", file=sys.stderr)
+    clip_names = generate_media(media_dir, args.clips, args.duration, args.size)
+    server = MediaServer(media_dir, args.rate, args.latency)
+    report = {
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'environment': environment(),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'work_dir', 'compare')},
+        'scenarios': [],
+    }
+    try:
+        for codec in args.codecs.split(","):
+            # The encode mode only matters when re-encoding
+            modes = args.encode_modes.split(",") if codec in VIDEO_ENCODERS else [ENCODE_STANDARD]
+            for encode_mode in modes:
+                if encode_mode not in ENCODE_MODES:
+                    raise SystemExit(f"Unknown encode mode: {encode_mode}")
+                for jobs in (int(j) for j in args.jobs.split(",")):
+                    print(f"Running jobs={jobs} codec={codec} mode={encode_mode}...", file=sys.stderr)
+                    report['scenarios'].append(
+                        run_scenario(server, clip_names, args.work_dir, jobs, codec, encode_mode, args.profile,
+                                     args.duration))
+        if args.thumbnail_runs:
+            print("Running thumbnail benchmark...", file=sys.stderr)
+            report['thumbnail'] = run_thumbnail_benchmark(server, media_dir, args.work_dir, args.thumbnail_runs)
+    finally:
+        server.close()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,18 +1,38 @@
 import sys
+import time
+STARTUP_MARKS = [("start", time.perf_counter())]  # (step, time it ended) for --startup-timing
 import os
-import subprocess
+import json
+import threading
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel,
     QPushButton, QLineEdit, QStackedWidget, QComboBox, QTextEdit,
-    QMessageBox, QProgressBar, QCheckBox, QFileDialog
+    QMessageBox, QProgressBar, QCheckBox, QFileDialog, QSpinBox,
+    QTableWidget, QTableWidgetItem, QHeaderView, QListWidget, QListWidgetItem
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from yt_dlp import YoutubeDL
-from mutagen.id3 import ID3, APIC
-from PIL import Image
+from PyQt5.QtCore import Qt, QObject, QThread, QTimer, QEvent, pyqtSignal
+STARTUP_MARKS.append(("import PyQt5", time.perf_counter()))
+from ud_engine import (
+    MAX_CONCURRENT_DOWNLOADS, CONCURRENT_FRAGMENTS, PRIORITIES, ENCODE_MODES, ENCODER_PROFILES, PROFILE_BALANCED,
+    AUDIO_MODES, FORMAT_AUTO, PROGRESS_INTERVAL, WARM_UP_MODULES, TAGGING_MODULES, NETWORK_STAGES,
+    FormatIndex, JobScheduler, auto_format, entry_url, format_metrics, probe_url, resolve_format, warm_up
+)
+STARTUP_MARKS.append(("import ud_engine", time.perf_counter()))
 
 # Constants
 DEFAULT_SAVE_PATH = "."  # Current directory as default save path
+# Generic quality presets offered for playlists, where entries don't share format ids
+PLAYLIST_FORMATS = [
+    ("best_quality", "bestvideo"),
+    ("best_compatible", FORMAT_AUTO),
+    # Height limits also prefer formats that need no re-encode, the best one up to that height otherwise
+    ("2160p", auto_format(2160)),
+    ("1440p", auto_format(1440)),
+    ("1080p", auto_format(1080)),
+    ("720p", auto_format(720)),
+    ("480p", auto_format(480)),
+    ("360p", auto_format(360)),
+]
 STYLESHEET = """
     QWidget { background-color: #222; color: white; font-family: Arial; }
     QLineEdit, QComboBox {
@@ -51,12 +71,51 @@ LANGUAGES = {
         'audio_only': "Audio only",
         'codec': "Select Output Codec:",
         'thumbnail': "Download and embed thumbnail (for audio only)",
+        'audio_mode': "Audio output:",
+        'audio_mp3': "MP3 320 kbps",
+        'audio_original': "Original (no re-encode)",
         'input_error': "Please enter a valid URL.",
         'error': "Error",
         'extract_error': "Failed to extract video info: {}",
         'starting': "Starting download...\nFormat: {}\nCodec: {}",
         'will_thumbnail': "Will download and embed thumbnail",
         'options_for': "Options for: {}",
+        'encode_mode': "Encoding mode:",
+        'encode_standard': "Standard (single process)",
+        'encode_segmented': "Segmented (all CPU cores)",
+        'encode_merge': "Single pass (encode during merge)",
+        'profile': "Encoder profile:",
+        'profile_fast': "Fast (larger files, audio copied)",
+        'profile_balanced': "Balanced",
+        'profile_archive': "Archive (slow, best quality)",
+        'parallel': "Parallel downloads:",
+        'fragments': "Connections per stream:",
+        'bandwidth_limit': "Bandwidth limit:",
+        'unlimited': "Unlimited",
+        'priority': "Encoder priority:",
+        'priority_normal': "Normal",
+        'priority_low': "Low",
+        'priority_idle': "Idle",
+        'priority_tip': "CPU priority of ffmpeg. Not applied in the single pass mode, where yt-dlp starts ffmpeg.",
+        'queue_headers': ["Title", "Status", "Progress"],
+        'queued': "Queued",
+        'running': "Downloading",
+        'done': "Done",
+        'failed': "Failed",
+        'waiting': "Waiting for encoder",
+        'processing': "Processing",
+        'added_to_queue': "Added to queue: {}",
+        'playlist_for': "Playlist: {}",
+        'playlist_count': "Playlist: {} ({} entries)",
+        'best_quality': "Best quality",
+        'best_compatible': "Best without re-encoding",
+        'auto_format': "Auto: {}",
+        're_encode': "re-encode",
+        'use_archive': "Skip videos already downloaded to this folder",
+        'timing': "Timing: {}",
+        'batch_timing': "Batch finished: {:.1f}s network, {:.1f}s processing ({})",
+        'network_bound': "network-bound",
+        'processing_bound': "processing-bound",
     },
     'uk': {
         'title': "Завантажувач YouTube",
@@ -71,232 +130,174 @@ LANGUAGES = {
         'audio_only': "Тільки аудіо",
         'codec': "Виберіть кодек виходу:",
         'thumbnail': "Завантажити та вставити обкладинку (тільки для аудіо)",
+        'audio_mode': "Аудіо на виході:",
+        'audio_mp3': "MP3 320 кбіт/с",
+        'audio_original': "Оригінал (без перекодування)",
         'input_error': "Будь ласка, введіть коректне посилання.",
         'error': "Помилка",
         'extract_error': "Не вдалося отримати інформацію про відео: {}",
         'starting': "Початок завантаження...\nФормат: {}\nКодек: {}",
         'will_thumbnail': "Буде завантажено та вставлено обкладинку",
         'options_for': "Опції для: {}",
+        'encode_mode': "Режим кодування:",
+        'encode_standard': "Стандартний (один процес)",
+        'encode_segmented': "Сегментований (усі ядра CPU)",
+        'encode_merge': "Один прохід (кодування під час злиття)",
+        'profile': "Профіль кодування:",
+        'profile_fast': "Швидкий (більші файли, аудіо копіюється)",
+        'profile_balanced': "Збалансований",
+        'profile_archive': "Архівний (повільно, найкраща якість)",
+        'parallel': "Паралельних завантажень:",
+        'fragments': "З'єднань на потік:",
+        'bandwidth_limit': "Обмеження швидкості:",
+        'unlimited': "Без обмежень",
+        'priority': "Пріоритет кодування:",
+        'priority_normal': "Звичайний",
+        'priority_low': "Низький",
+        'priority_idle': "Фоновий",
+        'priority_tip': "Пріоритет процесора для ffmpeg. Не застосовується в режимі \"один прохід\", де ffmpeg запускає yt-dlp.",
+        'queue_headers': ["Назва", "Статус", "Прогрес"],
+        'queued': "У черзі",
+        'running': "Завантаження",
+        'done': "Готово",
+        'failed': "Помилка",
+        'waiting': "Очікує кодування",
+        'processing': "Обробка",
+        'added_to_queue': "Додано до черги: {}",
+        'playlist_for': "Плейлист: {}",
+        'playlist_count': "Плейлист: {} ({} записів)",
+        'best_quality': "Найкраща якість",
+        'best_compatible': "Найкраща без перекодування",
+        'auto_format': "Авто: {}",
+        're_encode': "перекодування",
+        'use_archive': "Пропускати відео, вже завантажені в цю папку",
+        'timing': "Час: {}",
+        'batch_timing': "Пакет завершено: {:.1f} с мережа, {:.1f} с обробка ({})",
+        'network_bound': "обмежено мережею",
+        'processing_bound': "обмежено обробкою",
     }
 }
 
-def get_ffmpeg_path(tool="ffmpeg"):
-    """
-    Returns the path to ffmpeg or ffprobe, working for both development and bundled (PyInstaller) environments.
-    """
-    if getattr(sys, 'frozen', False):
-        # If bundled, look for ffmpeg/ffprobe in the same directory as the executable
-        base_path = sys._MEIPASS if hasattr(sys, '_MEIPASS') else os.path.dirname(sys.executable)
-        exe_name = tool + (".exe" if os.name == "nt" else "")
-        ffmpeg_path = os.path.join(base_path, exe_name)
-        if os.path.exists(ffmpeg_path):
-            return ffmpeg_path
-    # Fallback: just use the tool name (should be in PATH)
-    return tool
-
-# Worker thread for downloading and embedding thumbnail
-class DownloadWorker(QThread):
-    progress = pyqtSignal(str)          # For log messages
-    progress_update = pyqtSignal(int)   # For progress bar updates
-    finished = pyqtSignal(bool, str)    # For completion status
-
-    def __init__(self, url, save_path, selected_format, selected_codec, download_thumbnail=False):
-        super().__init__()
+def format_speed(speed):
+    for unit in ("B/s", "KB/s", "MB/s"):
+        if speed < 1024:
+            return f"{speed:.0f} {unit}"
+        speed /= 1024
+    return f"{speed:.1f} GB/s"
+
+# Worker thread for probing available formats without blocking the GUI
+class InfoWorker(QThread):
+    info_ready = pyqtSignal(object)     # Extracted info dict of a single video
+    playlist_ready = pyqtSignal(object) # Playlist info dict (entries not resolved yet)
+    entries_found = pyqtSignal(object)  # List of flat playlist entries, sent as they are listed
+    failed = pyqtSignal(str)            # Error message
+
+    def __init__(self, url, parent=None):
+        super().__init__(parent)
         self.url = url
-        self.save_path = save_path
-        self.selected_format = selected_format
-        self.selected_codec = selected_codec
-        self.download_thumbnail = download_thumbnail
-        self.is_video = self.selected_format != "bestaudio"
-        self.download_max_progress = 90 if self.is_video else 100  # Reserve 10% for re-encoding if video
-        self.files_progress = {}
-        self.total_download_bytes = 0
-        self.downloaded_bytes = 0
-        self.downloaded_file = None
+        self.cancelled = False
 
-    def run(self):
-        if self.is_video:
-            ydl_opts = {
-                'format': f"{self.selected_format}+bestaudio/best",
-                'outtmpl': os.path.join(self.save_path, "%(title)s.%(ext)s"),
-                'progress_hooks': [self.progress_hook],
-                'merge_output_format': 'mp4',
-            }
-            info = self.download_with_ydl(ydl_opts)
-            if info:
-                if self.selected_codec != "Original":
-                    self.reencode_video()
-                else:
-                    self.progress_update.emit(100)
-                    self.finished.emit(True, "Download completed successfully!")
-            else:
-                self.finished.emit(False, "Download failed")
-        else:
-            ydl_opts = {
-                'format': 'bestaudio',
-                'outtmpl': os.path.join(self.save_path, "%(title)s.%(ext)s"),
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '320',
-                }],
-                'progress_hooks': [self.progress_hook],
-            }
-            if self.download_thumbnail:
-                ydl_opts['writethumbnail'] = True
-            info = self.download_with_ydl(ydl_opts)
-            if info:
-                self.progress_update.emit(100)
-                self.finished.emit(True, "Download completed successfully!")
-                # Try to find the thumbnail file by base name and common extensions
-                if self.download_thumbnail:
-                    base, _ = os.path.splitext(self.downloaded_file)
-                    for ext in [".webp", ".jpg", ".jpeg", ".png"]:
-                        candidate = base + ext
-                        if os.path.exists(candidate):
-                            thumbnail_file = candidate
-                            if thumbnail_file.endswith(".webp"):
-                                thumbnail_file = self.convert_webp_to_jpg(thumbnail_file)
-                            if thumbnail_file and os.path.exists(thumbnail_file):
-                                self.embed_thumbnail(self.downloaded_file, thumbnail_file)
-                                break
-                    else:
-                        self.progress.emit("Thumbnail file not found or conversion failed")
-            else:
-                self.finished.emit(False, "Download failed")
-
-    def download_with_ydl(self, ydl_opts):
-        try:
-            with YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(self.url, download=True)
-                self.downloaded_file = ydl.prepare_filename(info)
-                # If audio extraction, update to .mp3 if needed
-                if (
-                    not self.is_video
-                    and 'ext' in info
-                    and info['ext'] != 'mp3'
-                ):
-                    # The postprocessor changes the extension to mp3
-                    base, _ = os.path.splitext(self.downloaded_file)
-                    mp3_file = base + ".mp3"
-                    if os.path.exists(mp3_file):
-                        self.downloaded_file = mp3_file
-                # Also handle the case where info['ext'] is already 'mp3'
-                elif not self.is_video and 'ext' in info and info['ext'] == 'mp3':
-                    base, _ = os.path.splitext(self.downloaded_file)
-                    mp3_file = base + ".mp3"
-                    if os.path.exists(mp3_file):
-                        self.downloaded_file = mp3_file
-                return info
-        except Exception as e:
-            self.progress.emit(f"Error: {str(e)}")
-            return None
-
-    def progress_hook(self, d):
-        if d['status'] == 'downloading':
-            filename = d['filename']
-            if filename not in self.files_progress:
-                total = d.get('total_bytes') or d.get('total_bytes_estimate')
-                if total:
-                    self.files_progress[filename] = {'total': total, 'downloaded': 0}
-                    self.total_download_bytes += total
-            if filename in self.files_progress:
-                self.files_progress[filename]['downloaded'] = d['downloaded_bytes']
-                self.downloaded_bytes = sum(f['downloaded'] for f in self.files_progress.values())
-                if self.total_download_bytes > 0:
-                    download_progress = (self.downloaded_bytes / self.total_download_bytes) * self.download_max_progress
-                    self.progress_update.emit(int(download_progress))
-        elif d['status'] == 'finished':
-            filename = d['filename']
-            if filename in self.files_progress:
-                self.files_progress[filename]['downloaded'] = self.files_progress[filename]['total']
-                self.downloaded_bytes = sum(f['downloaded'] for f in self.files_progress.values())
-                if self.total_download_bytes > 0:
-                    download_progress = (self.downloaded_bytes / self.total_download_bytes) * self.download_max_progress
-                    self.progress_update.emit(int(download_progress))
-
-    def reencode_video(self):
-        output_file = self.downloaded_file.replace('.mp4', f'_{self.selected_codec}.mp4')
-        codec_map = {
-            "H.264": "libx264",
-            "H.265": "libx265",
-            "VP9": "libvpx-vp9",
-        }
-        if self.selected_codec not in codec_map:
-            self.finished.emit(False, "Unsupported codec selected")
-            return
+    def cancel(self):
+        self.cancelled = True
 
-        cmd = [get_ffmpeg_path("ffprobe"), "-v", "error", "-show_entries", "format=duration",
-               "-of", "default=noprint_wrappers=1:nokey=1", self.downloaded_file]
+    def run(self):
         try:
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, check=True)
-            duration = float(result.stdout.strip())
+            info = probe_url(self.url, self.playlist_ready.emit, self.entries_found.emit, lambda: self.cancelled)
         except Exception as e:
-            self.progress.emit(f"Failed to get duration: {str(e)}")
-            self.finished.emit(False, "Re-encoding failed")
+            self.failed.emit(str(e))
             return
-
-        cmd = [
-            get_ffmpeg_path("ffmpeg"), "-i", self.downloaded_file, "-c:v", codec_map[self.selected_codec],
-            "-c:a", "aac", "-y", "-progress", "pipe:1", output_file
-        ]
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        current_time = 0
-        while True:
-            line = process.stdout.readline()
-            if not line:
-                break
-            line = line.strip()
-            if line.startswith("out_time="):
-                time_str = line.split("=", 1)[1]
-                # out_time is in format HH:MM:SS.microseconds
-                try:
-                    h, m, s = time_str.split(":")
-                    s = float(s)
-                    current_time = int(h) * 3600 + int(m) * 60 + s
-                    if duration > 0:
-                        reencode_progress = 90 + (current_time / duration) * 10
-                        self.progress_update.emit(int(reencode_progress))
-                except Exception:
-                    pass
-        process.wait()
-        if process.returncode == 0:
-            self.progress_update.emit(100)
-            self.finished.emit(True, "Re-encoding completed successfully!")
-            try:
-                os.remove(self.downloaded_file)
-                os.rename(output_file, self.downloaded_file)
-            except Exception as e:
-                self.progress.emit(f"Warning: Could not replace original file: {str(e)}")
-        else:
-            self.finished.emit(False, "Re-encoding failed")
-
-    def embed_thumbnail(self, audio_file, thumbnail_file):
-        try:
-            audio = ID3(audio_file)
-            with open(thumbnail_file, "rb") as img:
-                mime = "image/jpeg" if thumbnail_file.lower().endswith((".jpg", ".jpeg")) else "image/png"
-                audio.add(APIC(
-                    encoding=3,
-                    mime=mime,
-                    type=3,
-                    desc="Cover",
-                    data=img.read()
-                ))
-            audio.save()
-            self.progress.emit("Thumbnail embedded successfully")
-        except Exception as e:
-            self.progress.emit(f"Failed to embed thumbnail: {str(e)}")
-
-    def convert_webp_to_jpg(self, webp_file):
-        try:
-            img = Image.open(webp_file)
-            jpg_file = webp_file.replace(".webp", ".jpg")
-            img.convert("RGB").save(jpg_file, "JPEG")
-            return jpg_file
-        except Exception as e:
-            self.progress.emit(f"Failed to convert thumbnail: {str(e)}")
-            return None
+        if info is not None and not self.cancelled:
+            self.info_ready.emit(info)
+
+# Qt front for the engine's JobScheduler: its callbacks arrive on worker threads and are
+# re-emitted as signals, which Qt delivers to the GUI thread. Progress, speed and log callbacks
+# are only buffered and sent in one go by a GUI-thread timer, so busy jobs can't flood the event loop.
+class DownloadQueue(QObject):
+    job_added = pyqtSignal(int, str)          # Job id, label
+    job_status = pyqtSignal(int, str)         # Job id, status key ('queued', 'running', 'waiting', 'processing', 'done', 'failed')
+    job_progress = pyqtSignal(int, int)       # Job id, percent
+    job_speed = pyqtSignal(int, object, object)  # Job id, bytes/s, seconds left (None if unknown)
+    job_logs = pyqtSignal(object)             # List of (job id, log message) since the last flush
+    job_metrics = pyqtSignal(int, object)     # Job id, JobScheduler.job_record() of a finished job
+    aggregate_progress = pyqtSignal(int)      # Mean progress of the current batch
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_DOWNLOADS):
+        super().__init__()
+        self.scheduler = JobScheduler(max_concurrent)
+        self.scheduler.on_job_added = self.job_added.emit
+        self.scheduler.on_job_status = self.update_status
+        self.scheduler.on_job_progress = self.buffer_progress
+        self.scheduler.on_job_speed = self.buffer_speed
+        self.scheduler.on_job_log = self.buffer_log
+        self.scheduler.on_job_metrics = self.buffer_metrics
+        self.scheduler.on_aggregate_progress = self.buffer_aggregate
+        self.buffer_lock = threading.Lock()
+        self.pending_progress = {}  # job id -> latest percent
+        self.pending_speed = {}     # job id -> latest (speed, eta)
+        self.pending_logs = []
+        self.pending_metrics = []  # Sent after the logs so they follow the job's last message
+        self.pending_aggregate = None
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setInterval(int(PROGRESS_INTERVAL * 1000))
+        self.flush_timer.timeout.connect(self.flush)
+        self.flush_timer.start()
+
+    def update_status(self, job_id, status):
+        if status != 'running':
+            # A speed still buffered from the download would otherwise reach the row after this status
+            with self.buffer_lock:
+                self.pending_speed.pop(job_id, None)
+        self.job_status.emit(job_id, status)
+
+    def buffer_progress(self, job_id, value):
+        with self.buffer_lock:
+            self.pending_progress[job_id] = value
+
+    def buffer_speed(self, job_id, speed, eta):
+        with self.buffer_lock:
+            self.pending_speed[job_id] = (speed, eta)
+
+    def buffer_log(self, job_id, msg):
+        with self.buffer_lock:
+            self.pending_logs.append((job_id, msg))
+
+    def buffer_metrics(self, job_id, record):
+        with self.buffer_lock:
+            self.pending_metrics.append((job_id, record))
+
+    def buffer_aggregate(self, value):
+        with self.buffer_lock:
+            self.pending_aggregate = value
+
+    def flush(self):
+        with self.buffer_lock:
+            progress, self.pending_progress = self.pending_progress, {}
+            speed, self.pending_speed = self.pending_speed, {}
+            logs, self.pending_logs = self.pending_logs, []
+            metrics, self.pending_metrics = self.pending_metrics, []
+            aggregate, self.pending_aggregate = self.pending_aggregate, None
+        if logs:
+            self.job_logs.emit(logs)
+        for job_id, record in metrics:
+            self.job_metrics.emit(job_id, record)
+        for job_id, (job_speed, eta) in speed.items():
+            self.job_speed.emit(job_id, job_speed, eta)
+        for job_id, value in progress.items():
+            self.job_progress.emit(job_id, value)
+        if aggregate is not None:
+            self.aggregate_progress.emit(aggregate)
+
+    def enqueue(self, *args, **kwargs):
+        return self.scheduler.enqueue(*args, **kwargs)
+
+    def set_max_concurrent(self, value):
+        self.scheduler.set_max_concurrent(value)
+
+    def set_bandwidth_limit(self, megabytes):
+        self.scheduler.set_bandwidth_limit(megabytes * 1024 * 1024)
+
+    def set_priority(self, priority):
+        self.scheduler.set_priority(priority)
 
 # Input page for URL and save path
 class InputPage(QWidget):
@@ -365,13 +366,42 @@ class OptionsPage(QWidget):
         self.lang_dict = lang_dict
         self.info_label.setText(self.lang_dict['options'])
         self.thumbnail_checkbox.setText(self.lang_dict['thumbnail'])
+        self.audio_mode_label.setText(self.lang_dict['audio_mode'])
+        for mode in AUDIO_MODES:
+            self.audio_mode_box.setItemText(self.audio_mode_box.findData(mode), self.lang_dict[f'audio_{mode}'])
         self.codec_label.setText(self.lang_dict['codec'])
+        self.encode_mode_label.setText(self.lang_dict['encode_mode'])
+        for mode in ENCODE_MODES:
+            self.encode_mode_box.setItemText(self.encode_mode_box.findData(mode), self.lang_dict[f'encode_{mode}'])
+        self.profile_label.setText(self.lang_dict['profile'])
+        for profile in ENCODER_PROFILES:
+            self.profile_box.setItemText(self.profile_box.findData(profile), self.lang_dict[f'profile_{profile}'])
+        self.parallel_label.setText(self.lang_dict['parallel'])
+        self.fragments_label.setText(self.lang_dict['fragments'])
+        self.bandwidth_label.setText(self.lang_dict['bandwidth_limit'])
+        self.bandwidth_box.setSpecialValueText(self.lang_dict['unlimited'])
+        self.priority_label.setText(self.lang_dict['priority'])
+        self.priority_box.setToolTip(self.lang_dict['priority_tip'])
+        for priority in PRIORITIES:
+            self.priority_box.setItemText(self.priority_box.findData(priority), self.lang_dict[f'priority_{priority}'])
+        self.archive_checkbox.setText(self.lang_dict['use_archive'])
+        self.queue_table.setHorizontalHeaderLabels(self.lang_dict['queue_headers'])
+        for row in range(self.queue_table.rowCount()):
+            status_item = self.queue_table.item(row, 1)
+            status_item.setText(self.lang_dict[status_item.data(Qt.UserRole)])
         self.back_button.setText(self.lang_dict['back'])
         self.download_button.setText(self.lang_dict['download'])
-        # Update audio only text in format_box if present
+        if self.format_index:
+            self.fill_formats()
+            return
+        # Update audio only and playlist preset texts in format_box if present
         idx = self.format_box.findData("bestaudio")
         if idx != -1:
             self.format_box.setItemText(idx, self.lang_dict['audio_only'])
+        for key, format_spec in PLAYLIST_FORMATS:
+            idx = self.format_box.findData(format_spec)
+            if idx != -1 and key in self.lang_dict:
+                self.format_box.setItemText(idx, self.lang_dict[key])
 
     def initUI(self):
         layout = QVBoxLayout(self)
@@ -385,11 +415,29 @@ class OptionsPage(QWidget):
         self.format_box.setFixedHeight(40)
         self.format_box.setMinimumWidth(300)
         layout.addWidget(self.format_box)
+        self.format_index = None  # FormatIndex of the current video, None for playlists
+
+        self.entries_list = QListWidget()
+        self.entries_list.setFixedHeight(120)
+        self.entries_list.setVisible(False)
+        layout.addWidget(self.entries_list)
 
         self.thumbnail_checkbox = QCheckBox(self.lang_dict['thumbnail'], self)
         self.thumbnail_checkbox.setEnabled(False)
         layout.addWidget(self.thumbnail_checkbox)
 
+        audio_mode_layout = QHBoxLayout()
+        self.audio_mode_label = QLabel(self.lang_dict['audio_mode'])
+        self.audio_mode_label.setStyleSheet("font-size: 16px;")
+        audio_mode_layout.addWidget(self.audio_mode_label)
+        self.audio_mode_box = QComboBox()
+        self.audio_mode_box.setFixedHeight(40)
+        for mode in AUDIO_MODES:
+            self.audio_mode_box.addItem(self.lang_dict[f'audio_{mode}'], mode)
+        self.audio_mode_box.setEnabled(False)
+        audio_mode_layout.addWidget(self.audio_mode_box)
+        layout.addLayout(audio_mode_layout)
+
         self.codec_label = QLabel(self.lang_dict['codec'])
         self.codec_label.setStyleSheet("font-size: 16px;")
         layout.addWidget(self.codec_label)
@@ -399,6 +447,84 @@ class OptionsPage(QWidget):
         self.codec_box.addItems(["Original", "H.264", "H.265", "VP9"])
         layout.addWidget(self.codec_box)
 
+        self.encode_mode_label = QLabel(self.lang_dict['encode_mode'])
+        self.encode_mode_label.setStyleSheet("font-size: 16px;")
+        layout.addWidget(self.encode_mode_label)
+
+        self.encode_mode_box = QComboBox()
+        self.encode_mode_box.setFixedHeight(40)
+        for mode in ENCODE_MODES:
+            self.encode_mode_box.addItem(self.lang_dict[f'encode_{mode}'], mode)
+        layout.addWidget(self.encode_mode_box)
+
+        self.profile_label = QLabel(self.lang_dict['profile'])
+        self.profile_label.setStyleSheet("font-size: 16px;")
+        layout.addWidget(self.profile_label)
+
+        self.profile_box = QComboBox()
+        self.profile_box.setFixedHeight(40)
+        for profile in ENCODER_PROFILES:
+            self.profile_box.addItem(self.lang_dict[f'profile_{profile}'], profile)
+        self.profile_box.setCurrentIndex(self.profile_box.findData(PROFILE_BALANCED))
+        layout.addWidget(self.profile_box)
+
+        parallel_layout = QHBoxLayout()
+        self.parallel_label = QLabel(self.lang_dict['parallel'])
+        self.parallel_label.setStyleSheet("font-size: 16px;")
+        parallel_layout.addWidget(self.parallel_label)
+        self.parallel_box = QSpinBox()
+        self.parallel_box.setRange(1, 16)
+        self.parallel_box.setValue(MAX_CONCURRENT_DOWNLOADS)
+        self.parallel_box.setFixedHeight(30)
+        parallel_layout.addWidget(self.parallel_box)
+        parallel_layout.addSpacing(20)
+        self.fragments_label = QLabel(self.lang_dict['fragments'])
+        self.fragments_label.setStyleSheet("font-size: 16px;")
+        parallel_layout.addWidget(self.fragments_label)
+        self.fragments_box = QSpinBox()
+        self.fragments_box.setRange(1, 16)
+        self.fragments_box.setValue(CONCURRENT_FRAGMENTS)
+        self.fragments_box.setFixedHeight(30)
+        parallel_layout.addWidget(self.fragments_box)
+        parallel_layout.addStretch()
+        layout.addLayout(parallel_layout)
+
+        resources_layout = QHBoxLayout()
+        self.bandwidth_label = QLabel(self.lang_dict['bandwidth_limit'])
+        self.bandwidth_label.setStyleSheet("font-size: 16px;")
+        resources_layout.addWidget(self.bandwidth_label)
+        self.bandwidth_box = QSpinBox()
+        self.bandwidth_box.setRange(0, 1000)
+        self.bandwidth_box.setSuffix(" MB/s")
+        self.bandwidth_box.setSpecialValueText(self.lang_dict['unlimited'])  # Shown for 0
+        self.bandwidth_box.setFixedHeight(30)
+        resources_layout.addWidget(self.bandwidth_box)
+        resources_layout.addSpacing(20)
+        self.priority_label = QLabel(self.lang_dict['priority'])
+        self.priority_label.setStyleSheet("font-size: 16px;")
+        resources_layout.addWidget(self.priority_label)
+        self.priority_box = QComboBox()
+        self.priority_box.setFixedHeight(30)
+        for priority in PRIORITIES:
+            self.priority_box.addItem(self.lang_dict[f'priority_{priority}'], priority)
+        self.priority_box.setToolTip(self.lang_dict['priority_tip'])
+        resources_layout.addWidget(self.priority_box)
+        resources_layout.addStretch()
+        layout.addLayout(resources_layout)
+
+        self.archive_checkbox = QCheckBox(self.lang_dict['use_archive'], self)
+        self.archive_checkbox.setChecked(True)
+        layout.addWidget(self.archive_checkbox)
+
+        self.queue_table = QTableWidget(0, 3)
+        self.queue_table.setHorizontalHeaderLabels(self.lang_dict['queue_headers'])
+        self.queue_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.queue_table.verticalHeader().setVisible(False)
+        self.queue_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.queue_table.setFixedHeight(140)
+        layout.addWidget(self.queue_table)
+        self.job_rows = {}  # job id -> table row
+
         self.progress_bar = QProgressBar()
         self.progress_bar.setFixedHeight(20)
         self.progress_bar.setValue(0)
@@ -421,22 +547,131 @@ class OptionsPage(QWidget):
         layout.addLayout(btn_layout)
 
         self.format_box.currentIndexChanged.connect(self.update_thumbnail_checkbox)
+        self.codec_box.currentIndexChanged.connect(lambda: self.format_index and self.fill_formats())
+
+    def worker_options(self):
+        """
+        Returns the extra DownloadJob keyword arguments selected on this page.
+        """
+        return {
+            'encode_mode': self.encode_mode_box.currentData(),
+            'encoder_profile': self.profile_box.currentData(),
+            'audio_mode': self.audio_mode_box.currentData(),
+            'use_archive': self.archive_checkbox.isChecked(),
+            'concurrent_fragments': self.fragments_box.value(),
+        }
+
+    def add_entries(self, entries):
+        for entry in entries:
+            item = QListWidgetItem(entry.get('title') or entry_url(entry))
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked)
+            item.setData(Qt.UserRole, entry_url(entry))
+            self.entries_list.addItem(item)
+
+    def add_job_row(self, job_id, label):
+        row = self.queue_table.rowCount()
+        self.queue_table.insertRow(row)
+        self.queue_table.setItem(row, 0, QTableWidgetItem(label))
+        self.queue_table.setItem(row, 1, QTableWidgetItem())
+        job_bar = QProgressBar()
+        job_bar.setValue(0)
+        self.queue_table.setCellWidget(row, 2, job_bar)
+        self.job_rows[job_id] = row
+
+    def set_job_status(self, job_id, status):
+        item = self.queue_table.item(self.job_rows[job_id], 1)
+        item.setData(Qt.UserRole, status)
+        item.setText(self.lang_dict[status])
+        if status != 'running':
+            self.queue_table.cellWidget(self.job_rows[job_id], 2).setFormat("%p%")  # Drop the speed
+
+    def set_job_progress(self, job_id, value):
+        self.queue_table.cellWidget(self.job_rows[job_id], 2).setValue(value)
+
+    def set_job_speed(self, job_id, speed, eta):
+        if self.queue_table.item(self.job_rows[job_id], 1).data(Qt.UserRole) != 'running':
+            return
+        job_bar = self.queue_table.cellWidget(self.job_rows[job_id], 2)
+        text = f"%p%  {format_speed(speed)}"
+        if eta is not None:
+            text += f"  {int(eta) // 60}:{int(eta) % 60:02d}"
+        job_bar.setFormat(text)
+
+    def append_job_logs(self, logs):
+        # One append per batch, each append re-lays out the whole document
+        self.log_output.append("\n".join(f"[#{job_id}] {msg}" for job_id, msg in logs))
+
+    def fill_formats(self):
+        """
+        Lists the indexed formats of the current video ranked for the selected codec, led by the
+        automatic choice, keeping the current selection.
+        """
+        selected = self.format_box.currentData()
+        codec = self.codec_box.currentText()
+        choices = self.format_index.choices(codec)
+        self.format_box.clear()
+        auto = self.format_index.auto(codec)
+        if auto:
+            copyable = self.format_index.copyable(auto, codec)
+            self.format_box.addItem(self.lang_dict['auto_format'].format(self.format_label(auto, copyable)), FORMAT_AUTO)
+        for choice, copyable in choices:
+            self.format_box.addItem(self.format_label(choice, copyable), choice['format_id'])
+        self.format_box.addItem(self.lang_dict['audio_only'], "bestaudio")
+        self.format_box.setCurrentIndex(max(self.format_box.findData(selected), 0))
+
+    def format_label(self, choice, copyable):
+        fps = choice['fps'] if choice['fps'] and choice['fps'] > 30 else ""
+        parts = [f"{choice['height']}p{fps} {choice['codec']} ({choice['ext']})"]
+        if choice['tbr']:
+            parts.append(f"{choice['tbr'] / 1000:.1f} Mb/s")
+        if choice['size']:
+            parts.append(f"~{choice['size'] / 1024 ** 2:.0f} MB")
+        if not copyable:
+            parts.append(self.lang_dict['re_encode'])
+        return " · ".join(parts)
 
     def update_thumbnail_checkbox(self):
         if self.format_box.currentData() == "bestaudio":
             self.thumbnail_checkbox.setEnabled(True)
+            self.audio_mode_box.setEnabled(True)
         else:
             self.thumbnail_checkbox.setEnabled(False)
+            self.audio_mode_box.setEnabled(False)
 
 # Main application window
 class MainWindow(QWidget):
-    def __init__(self):
+    def __init__(self, startup_timing=False):
         super().__init__()
+        self.startup_timing = startup_timing
+        self.first_paint = None
         self.current_lang = 'en'
         self.lang_dict = LANGUAGES[self.current_lang]
+        self.current_info = None
+        self.info_worker = None
+        self.playlist_info = None     # Set while the options page shows a playlist
+        self.playlist_follow = None   # Download settings applied to entries still being listed
+        self.batch_seconds = [0.0, 0.0]  # Network and processing time of the jobs finished in this batch
         self.setWindowTitle(self.lang_dict['title'])
-        self.resize(500, 400)
+        self.resize(600, 900)
         self.initUI()
+        self.installEventFilter(self)  # Watches for the first paint
+
+    def eventFilter(self, obj, event):
+        if obj is self and event.type() == QEvent.Paint and self.first_paint is None:
+            self.first_paint = time.perf_counter()
+            # Queued so the first frame is finished before anything else runs
+            QTimer.singleShot(0, self.first_painted)
+        return super().eventFilter(obj, event)
+
+    def first_painted(self):
+        self.removeEventFilter(self)
+        if self.startup_timing:
+            write_startup_report(startup_report(self.first_paint))
+            QApplication.quit()
+        else:
+            # yt-dlp is imported while the user enters a URL instead of before the window shows
+            threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
 
     def initUI(self):
         main_layout = QVBoxLayout(self)
@@ -468,6 +703,19 @@ class MainWindow(QWidget):
         self.options_page.back_button.clicked.connect(lambda: self.stacked_widget.setCurrentWidget(self.input_page))
         self.options_page.download_button.clicked.connect(self.startDownload)
 
+        self.download_queue = DownloadQueue(self.options_page.parallel_box.value())
+        self.download_queue.job_added.connect(self.options_page.add_job_row)
+        self.download_queue.job_status.connect(self.options_page.set_job_status)
+        self.download_queue.job_progress.connect(self.options_page.set_job_progress)
+        self.download_queue.job_speed.connect(self.options_page.set_job_speed)
+        self.download_queue.job_logs.connect(self.options_page.append_job_logs)
+        self.download_queue.job_metrics.connect(self.show_job_metrics)
+        self.download_queue.aggregate_progress.connect(self.options_page.progress_bar.setValue)
+        self.options_page.parallel_box.valueChanged.connect(self.download_queue.set_max_concurrent)
+        self.options_page.bandwidth_box.valueChanged.connect(self.download_queue.set_bandwidth_limit)
+        self.options_page.priority_box.currentIndexChanged.connect(
+            lambda: self.download_queue.set_priority(self.options_page.priority_box.currentData()))
+
     def change_language(self):
         lang_code = self.lang_box.currentData()
         self.current_lang = lang_code
@@ -485,53 +733,143 @@ class MainWindow(QWidget):
         self.extract_video_info(url)
 
     def extract_video_info(self, url):
-        try:
-            with YoutubeDL({'quiet': True}) as ydl:
-                info = ydl.extract_info(url, download=False)
-            self.populate_options(info)
-        except Exception as e:
-            QMessageBox.critical(self, self.lang_dict['error'], self.lang_dict['extract_error'].format(str(e)))
+        if self.info_worker is not None:
+            self.info_worker.cancel()  # Stop listing a previous playlist
+        self.input_page.next_button.setEnabled(False)
+        self.info_worker = InfoWorker(url, self)
+        self.info_worker.info_ready.connect(self.populate_options)
+        self.info_worker.playlist_ready.connect(self.populate_playlist_options)
+        self.info_worker.entries_found.connect(self.add_playlist_entries)
+        self.info_worker.failed.connect(self.extractFailed)
+        self.info_worker.finished.connect(lambda: self.input_page.next_button.setEnabled(True))
+        self.info_worker.start()
+
+    def show_job_metrics(self, job_id, record):
+        log = self.options_page.log_output
+        log.append(f"[#{job_id}] " + self.lang_dict['timing'].format(format_metrics(record)))
+        for stage, seconds in record['stages'].items():
+            self.batch_seconds[0 if stage in NETWORK_STAGES else 1] += seconds
+        if self.download_queue.scheduler.is_idle():
+            network, processing = self.batch_seconds
+            bound = self.lang_dict['network_bound' if network >= processing else 'processing_bound']
+            log.append(self.lang_dict['batch_timing'].format(network, processing, bound))
+            self.batch_seconds = [0.0, 0.0]
+
+    def extractFailed(self, msg):
+        QMessageBox.critical(self, self.lang_dict['error'], self.lang_dict['extract_error'].format(msg))
 
     def populate_options(self, info):
+        self.current_info = info
+        self.playlist_info = None
+        self.playlist_follow = None
+        self.options_page.entries_list.setVisible(False)
         self.options_page.format_box.clear()
-        video_formats = [fmt for fmt in info['formats'] if fmt.get('vcodec') != 'none' and fmt.get('height')]
-        for fmt in video_formats:
-            height = fmt.get('height', 'unknown')
-            vcodec = fmt.get('vcodec', 'unknown').split('.')[0]
-            ext = fmt.get('ext', 'unknown')
-            format_id = fmt['format_id']
-            text = f"{height}p {vcodec} ({ext})"
-            self.options_page.format_box.addItem(text, format_id)
-        self.options_page.format_box.addItem(self.lang_dict['audio_only'], "bestaudio")
-        self.options_page.log_output.clear()
+        self.options_page.format_index = FormatIndex(info)
+        self.options_page.fill_formats()
         self.options_page.info_label.setText(self.lang_dict['options_for'].format(info.get('title', 'Video')))
         self.stacked_widget.setCurrentWidget(self.options_page)
         self.options_page.update_thumbnail_checkbox()
 
+    def populate_playlist_options(self, info):
+        self.current_info = None
+        self.playlist_info = info
+        self.playlist_follow = None
+        self.options_page.format_box.clear()
+        self.options_page.format_index = None
+        for key, format_spec in PLAYLIST_FORMATS:
+            self.options_page.format_box.addItem(self.lang_dict.get(key, key), format_spec)
+        self.options_page.format_box.addItem(self.lang_dict['audio_only'], "bestaudio")
+        self.options_page.entries_list.clear()
+        self.options_page.entries_list.setVisible(True)
+        self.options_page.info_label.setText(self.lang_dict['playlist_for'].format(info.get('title', 'Playlist')))
+        self.input_page.next_button.setEnabled(True)  # Listing continues in the background
+        self.stacked_widget.setCurrentWidget(self.options_page)
+        self.options_page.update_thumbnail_checkbox()
+
+    def add_playlist_entries(self, entries):
+        if self.playlist_info is None or self.sender() is not self.info_worker:
+            return
+        first_row = self.options_page.entries_list.count()
+        self.options_page.add_entries(entries)
+        count = self.options_page.entries_list.count()
+        self.options_page.info_label.setText(
+            self.lang_dict['playlist_count'].format(self.playlist_info.get('title', 'Playlist'), count))
+        if self.playlist_follow:
+            # Download was already started, queue entries as soon as they are listed
+            self.enqueue_playlist_entries(first_row, *self.playlist_follow)
+
+    def enqueue_playlist_entries(self, first_row, selected_format, selected_codec, download_thumbnail, options):
+        # Entries are queued without info so each one is fully resolved only when its job starts
+        entries_list = self.options_page.entries_list
+        for row in range(first_row, entries_list.count()):
+            item = entries_list.item(row)
+            if item.checkState() == Qt.Checked:
+                self.download_queue.enqueue(item.data(Qt.UserRole), self.save_path, selected_format,
+                                            selected_codec, download_thumbnail, None, item.text(), **options)
+
     def startDownload(self):
+        if self.playlist_info is not None:
+            self.startPlaylistDownload()
+            return
         url = self.input_page.url_input.text().strip()
-        selected_format = self.options_page.format_box.currentData()
         selected_codec = self.options_page.codec_box.currentText()
+        selected_format = resolve_format(self.options_page.format_box.currentData(), selected_codec,
+                                         self.options_page.format_index)
+        download_thumbnail = self.options_page.thumbnail_checkbox.isChecked() if selected_format == "bestaudio" else False
+        self.options_page.log_output.append(self.lang_dict['starting'].format(self.options_page.format_box.currentText(), selected_codec))
+        if download_thumbnail:
+            self.options_page.log_output.append(self.lang_dict['will_thumbnail'])
+        label = self.current_info.get('title', url) if self.current_info else url
+        self.download_queue.enqueue(url, self.save_path, selected_format, selected_codec, download_thumbnail,
+                                    self.current_info, label, **self.options_page.worker_options())
+        self.options_page.log_output.append(self.lang_dict['added_to_queue'].format(label))
+
+    def startPlaylistDownload(self):
+        selected_codec = self.options_page.codec_box.currentText()
+        selected_format = resolve_format(self.options_page.format_box.currentData(), selected_codec)
         download_thumbnail = self.options_page.thumbnail_checkbox.isChecked() if selected_format == "bestaudio" else False
         self.options_page.log_output.append(self.lang_dict['starting'].format(self.options_page.format_box.currentText(), selected_codec))
         if download_thumbnail:
             self.options_page.log_output.append(self.lang_dict['will_thumbnail'])
-        self.options_page.download_button.setEnabled(False)
-        self.worker = DownloadWorker(url, self.save_path, selected_format, selected_codec, download_thumbnail)
-        self.worker.progress.connect(self.options_page.log_output.append)
-        self.worker.progress_update.connect(self.options_page.progress_bar.setValue)
-        self.worker.finished.connect(self.downloadFinished)
-        self.worker.start()
-
-    def downloadFinished(self, success, msg):
-        self.options_page.log_output.append(msg)
-        self.options_page.download_button.setEnabled(True)
-        self.options_page.progress_bar.setValue(0 if not success else 100)
+        options = self.options_page.worker_options()
+        self.enqueue_playlist_entries(0, selected_format, selected_codec, download_thumbnail, options)
+        if self.info_worker.isRunning():
+            self.playlist_follow = (selected_format, selected_codec, download_thumbnail, options)
+        self.options_page.log_output.append(
+            self.lang_dict['added_to_queue'].format(self.playlist_info.get('title', 'Playlist')))
+
+def startup_report(first_paint):
+    """
+    Returns the --startup-timing report: seconds spent in each startup step up to the first paint,
+    then the import time of each lazily imported module, measured one after another. The tagging
+    modules go first: yt_dlp imports mutagen itself, which would leave them nothing to measure.
+    """
+    marks = STARTUP_MARKS + [("first paint", first_paint)]
+    steps = {step: round(end - previous_end, 4) for (_, previous_end), (step, end) in zip(marks, marks[1:])}
+    lazy_imports = {}
+    warm_up(TAGGING_MODULES + WARM_UP_MODULES, lambda name, seconds: lazy_imports.__setitem__(name, round(seconds, 4)))
+    return {
+        'frozen': getattr(sys, 'frozen', False),
+        'steps': steps,
+        'time_to_first_paint': round(first_paint - STARTUP_MARKS[0][1], 4),
+        'lazy_imports': lazy_imports,
+    }
+
+def write_startup_report(report):
+    # Windowed builds have no stdout, the report goes to a file in the working directory instead
+    line = json.dumps(report)
+    if sys.stdout is not None:
+        print(line, flush=True)
+    else:
+        with open(os.path.join(os.getcwd(), "startup_timing.json"), "w", encoding="utf-8") as f:
+            f.write(line + "\n")
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
+    STARTUP_MARKS.append(("create QApplication", time.perf_counter()))
     app.setStyle("Fusion")
     app.setStyleSheet(STYLESHEET)
-    main_win = MainWindow()
+    main_win = MainWindow(startup_timing="--startup-timing" in sys.argv)
+    STARTUP_MARKS.append(("create window", time.perf_counter()))
     main_win.show()
     sys.exit(app.exec_())
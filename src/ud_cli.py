@@ -0,0 +1,208 @@
+"""
+Headless batch front end for the download engine. Does not import Qt; reports progress
+as JSON lines on stdout, one object per event.
+
+    python src/ud_cli.py -o downloads -c H.264 -j 4 urls.txt
+    cat urls.txt | python src/ud_cli.py -f audio --thumbnail
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from ud_engine import (
+    MAX_CONCURRENT_DOWNLOADS, MAX_DOWNLOADS_PER_HOST, MAX_CONCURRENT_POSTPROCESS, CONCURRENT_FRAGMENTS, MAX_CONNECTIONS,
+    MAX_ENCODER_THREADS, PRIORITY_NORMAL, PRIORITIES,
+    ENCODE_STANDARD, ENCODE_MODES, PROFILE_BALANCED, ENCODER_PROFILES, AUDIO_MP3, AUDIO_MODES, VIDEO_ENCODERS,
+    THUMBNAIL_MAX_EDGE, THUMBNAIL_JPEG_QUALITY, ARCHIVE_FILENAME,
+    FORMAT_AUTO, DownloadArchive, JobScheduler, JsonLinesMetrics, PrometheusMetrics,
+    archive_codec, archive_key, archive_key_for_url, entry_url, probe_url, resolve_format
+)
+
+def parse_rate(value):
+    """
+    Parses a byte rate like "500K" or "2.5M" (binary multiples) for argparse.
+    """
+    multiplier = 1024 ** ("KMG".index(value[-1].upper()) + 1) if value[-1:].upper() in ("K", "M", "G") else 1
+    try:
+        return int(float(value[:-1] if multiplier > 1 else value) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid rate: {value!r}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download videos or audio without the GUI.")
+    parser.add_argument("sources", nargs="*",
+                        help="Files with one URL per line ('-' for stdin). Stdin is read when no URLs are given.")
+    parser.add_argument("-u", "--url", action="append", default=[], help="URL to download, may be repeated")
+    parser.add_argument("-o", "--output", default=".", help="Save directory")
+    parser.add_argument("-f", "--format", default=FORMAT_AUTO,
+                        help="yt-dlp video format id or selector (e.g. 'bestvideo[height<=1080]'), 'audio', or "
+                             "'auto' for the best video that needs no re-encode to the codec (default), or e.g. "
+                             "'auto[height<=1080]' for the same up to a height")
+    parser.add_argument("-c", "--codec", default="Original", choices=["Original", *VIDEO_ENCODERS],
+                        help="Output video codec")
+    parser.add_argument("--encode-mode", default=ENCODE_STANDARD, choices=ENCODE_MODES)
+    parser.add_argument("--profile", default=PROFILE_BALANCED, choices=ENCODER_PROFILES,
+                        help="Encoder speed/quality trade-off: preset, CRF, threading and audio copy")
+    parser.add_argument("--audio-mode", default=AUDIO_MP3, choices=AUDIO_MODES)
+    parser.add_argument("--thumbnail", action="store_true", help="Embed the thumbnail as cover art (audio only)")
+    parser.add_argument("--thumbnail-max-edge", type=int, default=THUMBNAIL_MAX_EDGE)
+    parser.add_argument("--thumbnail-quality", type=int, default=THUMBNAIL_JPEG_QUALITY)
+    parser.add_argument("-j", "--jobs", type=int, default=MAX_CONCURRENT_DOWNLOADS, help="Concurrent downloads")
+    parser.add_argument("--per-host", type=int, default=MAX_DOWNLOADS_PER_HOST, help="Concurrent downloads per host")
+    parser.add_argument("--postprocess-jobs", type=int, default=MAX_CONCURRENT_POSTPROCESS,
+                        help="Concurrent re-encodes/tagging")
+    parser.add_argument("--fragments", type=int, default=CONCURRENT_FRAGMENTS,
+                        help="Fragments of a DASH/HLS stream downloaded at once")
+    parser.add_argument("--no-parallel-streams", action="store_true",
+                        help="Download the video and audio streams of a format one after the other")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help="Download connections shared by all running jobs")
+    parser.add_argument("--limit-rate", type=parse_rate, default=0,
+                        help="Bandwidth cap shared by all downloads in bytes/s, with an optional K/M/G suffix (e.g. 5M)")
+    parser.add_argument("--encoder-threads", type=int, default=MAX_ENCODER_THREADS,
+                        help="Encoder threads shared by all concurrent re-encodes")
+    parser.add_argument("--priority", default=PRIORITY_NORMAL, choices=PRIORITIES,
+                        help="CPU priority of ffmpeg processes (not applied in --encode-mode merge, where yt-dlp starts ffmpeg)")
+    parser.add_argument("--archive", help=f"Download archive file (default: {ARCHIVE_FILENAME} in the save directory)")
+    parser.add_argument("--no-archive", action="store_true",
+                        help="Download everything again, without checking or updating the archive")
+    parser.add_argument("--metrics-file",
+                        help="Write per-job timings: Prometheus text format if the name ends in .prom, else JSON lines")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve Prometheus metrics at http://127.0.0.1:PORT/metrics while running")
+    return parser.parse_args(argv)
+
+def read_urls(lines):
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+def iter_urls(args):
+    yield from args.url
+    sources = args.sources or ([] if args.url else ["-"])
+    for source in sources:
+        if source == "-":
+            yield from read_urls(sys.stdin)
+        else:
+            with open(source, encoding="utf-8") as f:
+                yield from read_urls(f)
+
+class JsonLinesReporter:
+    """
+    Writes scheduler events to a stream as JSON lines. The scheduler only reports progress when a
+    job's percentage changes (at most 10 times a second); the latest download speed in bytes/s and
+    seconds left are added to each progress event.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.last_speed = {}  # job id -> (speed, eta)
+
+    def emit(self, event, **fields):
+        line = json.dumps({'event': event, 'time': round(time.time(), 3), **fields}, ensure_ascii=False)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def attach(self, scheduler):
+        scheduler.on_job_added = lambda job_id, label: self.emit('added', job=job_id, label=label)
+        scheduler.on_job_status = lambda job_id, status: self.emit('status', job=job_id, status=status)
+        scheduler.on_job_progress = self.job_progress
+        scheduler.on_job_speed = lambda job_id, speed, eta: self.last_speed.__setitem__(job_id, (speed, eta))
+        scheduler.on_job_log = lambda job_id, msg: self.emit('log', job=job_id, message=msg)
+        scheduler.on_job_metrics = lambda job_id, record: self.emit('metrics', **record)
+
+    def job_progress(self, job_id, value):
+        speed, eta = self.last_speed.get(job_id, (None, None))
+        self.emit('progress', job=job_id, progress=value,
+                  speed=round(speed) if speed is not None else None, eta=round(eta) if eta is not None else None)
+
+def main(argv=None):
+    args = parse_args(argv)
+    reporter = JsonLinesReporter(sys.stdout)
+    scheduler = JobScheduler(args.jobs, args.per_host, args.postprocess_jobs, max_connections=args.max_connections,
+                             bandwidth_limit=args.limit_rate, max_encoder_threads=args.encoder_threads,
+                             priority=args.priority)
+    reporter.attach(scheduler)
+    sinks = []
+    if args.metrics_file:
+        sinks.append(PrometheusMetrics(args.metrics_file) if args.metrics_file.endswith(".prom")
+                     else JsonLinesMetrics(args.metrics_file))
+    if args.metrics_port is not None:
+        sinks.append(PrometheusMetrics(port=args.metrics_port))
+    if sinks:
+        def record_metrics(job_id, record):
+            reporter.emit('metrics', **record)
+            for sink in sinks:
+                sink.record(record)
+        scheduler.on_job_metrics = record_metrics
+    # 'auto' becomes a selector rather than a per-video format id, so archive records stay comparable
+    selected_format = "bestaudio" if args.format == "audio" else resolve_format(args.format, args.codec)
+    download_thumbnail = args.thumbnail and selected_format == "bestaudio"
+    options = {
+        'encode_mode': args.encode_mode,
+        'encoder_profile': args.profile,
+        'audio_mode': args.audio_mode,
+        'thumbnail_max_edge': args.thumbnail_max_edge,
+        'thumbnail_quality': args.thumbnail_quality,
+        'quiet': True,  # Keep yt-dlp's console output out of the JSON stream
+        'use_archive': not args.no_archive,
+        'archive_path': args.archive,
+        'concurrent_fragments': args.fragments,
+        'parallel_streams': not args.no_parallel_streams,
+    }
+    archive = None
+    if not args.no_archive:
+        archive = DownloadArchive.open(args.archive or os.path.join(args.output, ARCHIVE_FILENAME))
+    codec = archive_codec(selected_format, args.codec, args.audio_mode)
+    skipped = 0
+
+    def archived(key, url):
+        # Finished items are skipped here, before any network request is made for them
+        nonlocal skipped
+        if archive and key and archive.is_done(key, selected_format, codec):
+            skipped += 1
+            reporter.emit('skipped', url=url)
+            return True
+        return False
+
+    def enqueue(url, info=None, label=None):
+        scheduler.enqueue(url, args.output, selected_format, args.codec, download_thumbnail, info, label, **options)
+
+    def enqueue_entries(entries):
+        # Playlist entries are resolved by their own jobs, only when they start
+        for entry in entries:
+            if not archived(archive_key(entry), entry_url(entry)):
+                enqueue(entry_url(entry), None, entry.get('title'))
+
+    probe_errors = 0
+    try:
+        for url in iter_urls(args):
+            if archived(archive_key_for_url(url), url):
+                continue
+            try:
+                info = probe_url(url, lambda playlist: reporter.emit('playlist', url=url, title=playlist.get('title')),
+                                 enqueue_entries)
+            except Exception as e:
+                probe_errors += 1
+                reporter.emit('error', url=url, message=str(e))
+                continue
+            if info is not None:
+                # Not pinned in the job: it takes the info from INFO_CACHE when it starts, while still fresh
+                enqueue(url, None, info.get('title'))
+        scheduler.wait()
+    except KeyboardInterrupt:
+        reporter.emit('interrupted')
+        return 130
+
+    results = [job['success'] for job in scheduler.jobs.values()]
+    failed = results.count(False) + probe_errors
+    reporter.emit('summary', total=len(results) + skipped, succeeded=results.count(True), skipped=skipped,
+                  failed=failed)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
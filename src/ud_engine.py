@@ -0,0 +1,1842 @@
+"""
+Download, encode and tagging engine shared by the GUI (UD3.py) and the command line (ud_cli.py).
+Nothing in here imports Qt; progress is reported through plain callbacks.
+yt-dlp, mutagen and Pillow are imported where they are first used, so importing this module is
+cheap and the GUI can show its window first (see warm_up()).
+"""
+import sys
+import os
+import copy
+import base64
+import json
+import re
+import importlib
+import hashlib
+import sqlite3
+from io import BytesIO
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from functools import cached_property, lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+# Constants
+INFO_CACHE_SIZE = 64  # Max number of extracted info dicts kept in memory
+INFO_CACHE_TTL = 30 * 60  # Seconds before a cached info dict is considered stale (format URLs expire)
+MAX_CONCURRENT_DOWNLOADS = 3  # Default number of jobs running at once
+MAX_DOWNLOADS_PER_HOST = 2  # Jobs allowed against the same host at once, to avoid throttling
+MAX_CONCURRENT_POSTPROCESS = max(1, (os.cpu_count() or 1) // 4)  # ffmpeg already uses several threads per encode
+CONCURRENT_FRAGMENTS = 4  # Fragments of a DASH/HLS stream fetched at once, per stream
+MAX_CONNECTIONS = 16  # Download connections shared by all running jobs (fragments x parallel streams)
+FRAGMENTED_PROTOCOLS = ('m3u8_native', 'http_dash_segments', 'http_dash_segments_generator', 'ism', 'f4m')
+MAX_ENCODER_THREADS = os.cpu_count() or 1  # Encoder threads shared by all concurrent ffmpeg encodes
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"    # Below normal, encodes yield to interactive programs
+PRIORITY_IDLE = "idle"  # Only uses otherwise idle CPU time
+PRIORITIES = (PRIORITY_NORMAL, PRIORITY_LOW, PRIORITY_IDLE)
+PRIORITY_NICE = {PRIORITY_NORMAL: 0, PRIORITY_LOW: 10, PRIORITY_IDLE: 19}
+PRIORITY_CLASSES = {  # Windows process priority classes
+    PRIORITY_NORMAL: getattr(subprocess, 'NORMAL_PRIORITY_CLASS', 0),
+    PRIORITY_LOW: getattr(subprocess, 'BELOW_NORMAL_PRIORITY_CLASS', 0),
+    PRIORITY_IDLE: getattr(subprocess, 'IDLE_PRIORITY_CLASS', 0),
+}
+POSTPROCESS_QUEUE_SIZE = 2  # Downloaded jobs allowed to wait for an encoder before downloads pause
+ENCODE_STANDARD = "standard"    # One ffmpeg process over the whole file
+ENCODE_SEGMENTED = "segmented"  # Split at keyframes and encode segments on all cores
+ENCODE_MERGE = "merge"          # Encode while yt-dlp merges video and audio, no intermediate file
+ENCODE_MODES = (ENCODE_STANDARD, ENCODE_SEGMENTED, ENCODE_MERGE)
+VIDEO_ENCODERS = {
+    "H.264": "libx264",
+    "H.265": "libx265",
+    "VP9": "libvpx-vp9",
+}
+PROFILE_FAST = "fast"          # Fastest presets, audio copied
+PROFILE_BALANCED = "balanced"  # ffmpeg's default presets for x264/x265, multi-threaded VP9, audio to AAC
+PROFILE_ARCHIVE = "archive"    # Slow presets and low CRF for long-term storage, audio copied
+ENCODER_PROFILES = (PROFILE_FAST, PROFILE_BALANCED, PROFILE_ARCHIVE)
+# profile -> encoder -> ffmpeg video options. libvpx-vp9 needs -b:v 0 for constant quality and
+# -row-mt/-tile-columns to use more than one core per tile
+PROFILE_VIDEO_ARGS = {
+    PROFILE_FAST: {
+        "libx264": ["-preset", "veryfast", "-crf", "23"],
+        "libx265": ["-preset", "superfast", "-crf", "28"],
+        "libvpx-vp9": ["-deadline", "realtime", "-cpu-used", "8", "-crf", "36", "-b:v", "0",
+                       "-row-mt", "1", "-tile-columns", "2"],
+    },
+    PROFILE_BALANCED: {
+        "libx264": ["-preset", "medium", "-crf", "23"],
+        "libx265": ["-preset", "medium", "-crf", "28"],
+        "libvpx-vp9": ["-deadline", "good", "-cpu-used", "4", "-crf", "32", "-b:v", "0",
+                       "-row-mt", "1", "-tile-columns", "2"],
+    },
+    PROFILE_ARCHIVE: {
+        "libx264": ["-preset", "slow", "-crf", "18"],
+        "libx265": ["-preset", "slow", "-crf", "22"],
+        "libvpx-vp9": ["-deadline", "good", "-cpu-used", "1", "-crf", "24", "-b:v", "0",
+                       "-row-mt", "1", "-tile-columns", "1", "-auto-alt-ref", "1", "-lag-in-frames", "25"],
+    },
+}
+PROFILE_AUDIO_COPY = {PROFILE_FAST: True, PROFILE_BALANCED: False, PROFILE_ARCHIVE: True}
+AUDIO_AAC_ARGS = ["-c:a", "aac", "-b:a", "192k"]
+MP4_AUDIO_CODECS = ("aac", "mp4a", "mp3", "ac3", "ac-3", "eac3", "ec-3")  # Can be stream-copied into mp4
+THUMBNAIL_MAX_EDGE = 800  # Embedded covers are downscaled to fit this many pixels per side
+THUMBNAIL_JPEG_QUALITY = 85  # JPEG quality of embedded covers
+AUDIO_MP3 = "mp3"            # Transcode to MP3 320 kbps
+AUDIO_ORIGINAL = "original"  # Keep the source codec, only remux into its matching container (m4a/opus/ogg)
+AUDIO_MODES = (AUDIO_MP3, AUDIO_ORIGINAL)
+# Prefixes of yt-dlp vcodec strings that each output codec can be stream-copied from
+CODEC_FAMILIES = {
+    "H.264": ("avc1", "avc3", "h264"),
+    "H.265": ("hvc1", "hev1", "h265", "hevc"),
+    "VP9": ("vp9", "vp09"),
+}
+FORMAT_AUTO = "auto"  # Best format that needs no re-encode for the selected codec, resolved per video
+AUTO_FORMAT_PATTERN = re.compile(r"auto(?:\[height<=(\d+)\])?")  # FORMAT_AUTO with an optional height limit
+PROTOCOL_PREFERENCE = ('https', 'http', 'http_dash_segments', 'm3u8_native')  # Among otherwise equal formats
+SEGMENT_MIN_SECONDS = 10  # Shortest segment worth a separate encoder process
+SEGMENTS_PER_WORKER = 3  # Extra segments per core so uneven segments still keep every core busy
+PLAYLIST_BATCH_SIZE = 50  # Flat playlist entries reported per callback
+PLAYLIST_BATCH_INTERVAL = 0.5  # Max seconds to hold back entries before sending a partial batch
+ARCHIVE_FILENAME = ".ud_archive.sqlite3"  # Download archive kept in each save directory
+STAGE_DOWNLOADING = "downloading"  # Download started, .part files may be left over
+STAGE_DOWNLOADED = "downloaded"    # Download complete, post-processing not finished
+STAGE_DONE = "done"                # Output file written
+HASH_CHUNK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 0.1  # Min seconds between progress reports of a job (10 Hz)
+SPEED_SMOOTHING = 0.3  # Weight of the newest sample in the smoothed download speed
+# Metric stage names of yt-dlp's own postprocessors (the rest, e.g. fixups and moving files, count as 'ytdlp_other')
+YTDLP_POSTPROCESSOR_STAGES = {'Merger': 'merge', 'ExtractAudio': 'audio_extract'}
+NETWORK_STAGES = ('extract', 'download', 'thumbnail_fetch')  # Everything else is local processing
+WARM_UP_MODULES = ("yt_dlp", "yt_dlp.extractor.extractors")  # Imported in the background once the GUI shows
+TAGGING_MODULES = ("PIL.Image", "mutagen.id3", "mutagen.mp4", "mutagen.flac")  # Only imported to embed thumbnails
+HOST_ALIASES = {'youtu.be': 'youtube.com', 'm.youtube.com': 'youtube.com', 'music.youtube.com': 'youtube.com'}
+
+@lru_cache(maxsize=None)
+def get_ffmpeg_path(tool="ffmpeg"):
+    """
+    Returns the path to ffmpeg or ffprobe, working for both development and bundled (PyInstaller) environments.
+    Resolved once per tool.
+    """
+    if getattr(sys, 'frozen', False):
+        # If bundled, look for ffmpeg/ffprobe in the same directory as the executable
+        base_path = sys._MEIPASS if hasattr(sys, '_MEIPASS') else os.path.dirname(sys.executable)
+        exe_name = tool + (".exe" if os.name == "nt" else "")
+        ffmpeg_path = os.path.join(base_path, exe_name)
+        if os.path.exists(ffmpeg_path):
+            return ffmpeg_path
+    # Fallback: just use the tool name (should be in PATH)
+    return tool
+
+def warm_up(modules=WARM_UP_MODULES, on_imported=None):
+    """
+    Imports modules ahead of first use, calling on_imported(name, seconds) after each one.
+    Meant to run on a background thread while the user is still typing a URL.
+    """
+    for name in modules:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        if on_imported:
+            on_imported(name, time.perf_counter() - start)
+
+def codec_matches(vcodec, codec):
+    """
+    Returns True if a source vcodec (e.g. "avc1.64001F") is already the selected output codec (e.g. "H.264").
+    """
+    return bool(vcodec) and vcodec.lower().startswith(CODEC_FAMILIES.get(codec, ()))
+
+def encoder_args(codec, profile, acodec=None):
+    """
+    Returns the ffmpeg video and audio options for an output codec (e.g. "VP9") under one of
+    ENCODER_PROFILES. Audio is copied if the profile allows it and the source codec (an ffprobe
+    codec_name or yt-dlp acodec) fits in mp4, otherwise it is encoded to AAC.
+    """
+    encoder = VIDEO_ENCODERS[codec]
+    video = ["-c:v", encoder, *PROFILE_VIDEO_ARGS[profile][encoder]]
+    if PROFILE_AUDIO_COPY[profile] and acodec and acodec.split(".")[0].lower() in MP4_AUDIO_CODECS:
+        return video, ["-c:a", "copy"]
+    return video, AUDIO_AAC_ARGS
+
+def parse_out_time(line):
+    """
+    Returns the seconds from an ffmpeg `-progress` b"out_time=HH:MM:SS.micro" line (bytes), or None for other lines.
+    """
+    if not line.startswith(b"out_time="):
+        return None
+    try:
+        h, m, s = line[9:].split(b":")
+        return int(h) * 3600 + int(m) * 60 + float(s)
+    except ValueError:
+        return None  # "N/A" before the first frame
+
+def spawn_process(cmd, priority=PRIORITY_NORMAL, **popen_args):
+    """
+    Starts a subprocess at one of PRIORITIES: a priority class on Windows, a nice value elsewhere.
+    """
+    if os.name == "nt":
+        return subprocess.Popen(cmd, creationflags=PRIORITY_CLASSES[priority], **popen_args)
+    process = subprocess.Popen(cmd, **popen_args)
+    if PRIORITY_NICE[priority]:
+        try:
+            os.setpriority(os.PRIO_PROCESS, process.pid, PRIORITY_NICE[priority])
+        except OSError:
+            pass  # Already exited
+    return process
+
+def wait_process(process, metrics=None):
+    """
+    Waits for a subprocess and returns its exit code. Its CPU time is added to metrics where
+    os.wait4 is available (not on Windows).
+    """
+    if not hasattr(os, "wait4"):
+        return process.wait()
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if metrics:
+        metrics.add_cpu('ffmpeg', rusage.ru_utime + rusage.ru_stime)
+    return process.returncode
+
+def run_tool(cmd, metrics=None, capture=False, priority=PRIORITY_NORMAL):
+    """
+    Runs ffmpeg or ffprobe to completion. Returns (exit code, stdout text if capture else None).
+    """
+    process = spawn_process(cmd, priority, stdout=subprocess.PIPE if capture else subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL, text=True)
+    output = process.stdout.read() if capture else None
+    return wait_process(process, metrics), output
+
+def run_ffmpeg_with_progress(cmd, on_time=None, metrics=None, priority=PRIORITY_NORMAL):
+    """
+    Runs an ffmpeg command that includes "-progress pipe:1" and calls on_time(seconds) as encoding advances.
+    Returns the process exit code. Only the progress output is read, undecoded; ffmpeg's log is discarded.
+    """
+    process = spawn_process(cmd, priority, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    for line in process.stdout:
+        if on_time and line.startswith(b"out_time="):
+            current_time = parse_out_time(line.rstrip())
+            if current_time is not None:
+                on_time(current_time)
+    return wait_process(process, metrics)
+
+class TokenBucket:
+    """
+    Bandwidth cap shared by several threads. consume(n) accounts n bytes and sleeps for as long
+    as the caller is ahead of the rate; up to one second of traffic may be sent as a burst.
+    A rate of 0 means unlimited.
+    """
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.tokens = min(self.tokens, rate)
+
+    def consume(self, amount):
+        with self.lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate) - amount
+            self.updated = now
+            # Tokens go negative instead of making callers queue, each one waits off its own debt
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+class JobMetrics:
+    """
+    Wall time per stage, bytes and CPU time of one DownloadJob. Stages that run more than once
+    (e.g. yt-dlp's fixups) are summed. Python CPU time is that of the job's own threads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()  # Segment encodes report from several threads
+        self.stages = {}   # stage -> seconds
+        self.streams = []  # {'file', 'bytes', 'seconds'} per downloaded stream
+        self.output_bytes = 0
+        self.cpu = {'python': 0.0, 'ffmpeg': 0.0}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_stream(self, filename, size, seconds):
+        with self.lock:
+            self.streams.append({'file': os.path.basename(filename), 'bytes': size,
+                                 'seconds': round(seconds, 3) if seconds is not None else None})
+
+    def add_cpu(self, kind, seconds):
+        with self.lock:
+            self.cpu[kind] += seconds
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'stages': {name: round(seconds, 3) for name, seconds in self.stages.items()},
+                'streams': list(self.streams),
+                'downloaded_bytes': sum(stream['bytes'] or 0 for stream in self.streams),
+                'output_bytes': self.output_bytes,
+                'cpu_seconds': {kind: round(seconds, 3) for kind, seconds in self.cpu.items()},
+            }
+
+def format_metrics(metrics):
+    """
+    Returns a one-line summary of a JobMetrics.as_dict() result for logs.
+    """
+    parts = [f"{name} {seconds:.1f}s" for name, seconds in metrics['stages'].items()]
+    if metrics['downloaded_bytes']:
+        parts.append(f"{metrics['downloaded_bytes'] / 1e6:.1f} MB in {len(metrics['streams'])} stream(s)")
+    cpu = metrics['cpu_seconds']
+    parts.append(f"CPU {cpu['python']:.1f}s python + {cpu['ffmpeg']:.1f}s ffmpeg")
+    return ", ".join(parts)
+
+class JsonLinesMetrics:
+    """
+    Appends one JSON object per finished job to a file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+class PrometheusMetrics:
+    """
+    Counters over all finished jobs in the Prometheus text format. They are rewritten to `path`
+    after every job (e.g. for node_exporter's textfile collector) and/or served at
+    http://127.0.0.1:<port>/metrics.
+    """
+    def __init__(self, path=None, port=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.jobs = Counter()           # status -> jobs
+        self.stage_seconds = Counter()  # stage -> seconds
+        self.cpu_seconds = Counter()    # 'python'/'ffmpeg' -> seconds
+        self.downloaded_bytes = 0
+        self.output_bytes = 0
+        if port is not None:
+            self.serve(port)
+
+    def record(self, record):
+        with self.lock:
+            self.jobs['done' if record['success'] else 'failed'] += 1
+            self.stage_seconds.update(record['stages'])
+            self.cpu_seconds.update(record['cpu_seconds'])
+            self.downloaded_bytes += record['downloaded_bytes']
+            self.output_bytes += record['output_bytes']
+            text = self.render()
+        if self.path:
+            # Written to a temporary file first so scrapers never see a partial file
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+
+    def render(self):
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {round(value, 3)}")
+
+        metric("ud_jobs_total", "Finished jobs by outcome.",
+               [(f'{{status="{status}"}}', n) for status, n in sorted(self.jobs.items())])
+        metric("ud_stage_seconds_total", "Wall time spent in each job stage.",
+               [(f'{{stage="{stage}"}}', s) for stage, s in sorted(self.stage_seconds.items())])
+        metric("ud_cpu_seconds_total", "CPU time of the jobs' Python threads and ffmpeg processes.",
+               [(f'{{kind="{kind}"}}', s) for kind, s in sorted(self.cpu_seconds.items())])
+        metric("ud_downloaded_bytes_total", "Bytes downloaded.", [("", self.downloaded_bytes)])
+        metric("ud_output_bytes_total", "Bytes of finished output files.", [("", self.output_bytes)])
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                with metrics.lock:
+                    body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="metrics-server", daemon=True).start()
+
+class InfoCache:
+    """
+    Thread-safe LRU cache of extract_info results keyed by extractor and video ID.
+    Entries expire after `ttl` seconds because the signed format URLs do too.
+    """
+    def __init__(self, maxsize=INFO_CACHE_SIZE, ttl=INFO_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # video key -> (timestamp, info)
+        self._aliases = {}             # url -> video key
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def video_key(info):
+        if not info.get('id'):
+            return None
+        return f"{info.get('extractor_key', '')}:{info['id']}"
+
+    def get(self, url):
+        with self._lock:
+            key = self._aliases.get(url)
+            entry = self._entries.get(key) if key else None
+            if entry is None:
+                return None
+            stored_at, info = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self._evict(key)
+                return None
+            self._entries.move_to_end(key)
+            return info
+
+    def put(self, url, info):
+        key = self.video_key(info)
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), info)
+            self._entries.move_to_end(key)
+            for alias in (url, info.get('webpage_url'), info.get('original_url')):
+                if alias:
+                    self._aliases[alias] = key
+            while len(self._entries) > self.maxsize:
+                self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        self._entries.pop(key, None)
+        self._aliases = {url: k for url, k in self._aliases.items() if k != key}
+
+INFO_CACHE = InfoCache()
+
+class YoutubeDLSession:
+    """
+    yt-dlp state shared by all probes and downloads of one run. Each caller still gets its own
+    YoutubeDL (options, hooks and format selection differ per job), but they share one request
+    director and cookie jar, so connections, TLS setup and cookies are kept between jobs, and one
+    set of extractors: the list of extractor classes is built once and per-job extractors are
+    copies of long-lived ones, sharing their caches (e.g. YouTube player code). Thread-safe.
+    The sharing relies on yt-dlp internals; if a yt-dlp release lacks them, open() falls back to
+    plain YoutubeDL instances.
+    """
+    def __init__(self, params=None):
+        self.params = {'quiet': True, **(params or {})}  # Network options (headers, proxy, timeout)
+        self.shared = None  # False once sharing is found unsupported by the installed yt-dlp
+        self._ydl = None  # Holds the shared request director and cookie jar, never downloads itself
+        self._extractors = {}  # ie_key -> extractor instance the per-job copies are made from
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def supported(YoutubeDL):
+        # Cached properties read the instance dict first, which is how the shared values are injected
+        return all(isinstance(getattr(YoutubeDL, name, None), cached_property)
+                   for name in ('_request_director', 'cookiejar')) and hasattr(YoutubeDL, 'add_info_extractor')
+
+    def _shared(self):
+        with self._lock:
+            if self._ydl is None:
+                from yt_dlp import YoutubeDL
+                ydl = YoutubeDL(self.params)
+                ydl._request_director  # Built here, once, with ydl.cookiejar
+                self._ydl = ydl
+            return self._ydl
+
+    def _attached(self, params):
+        """
+        Returns a YoutubeDL for `params` using the shared state. Raises AttributeError, TypeError
+        or KeyError if the installed yt-dlp doesn't have the internals this relies on.
+        """
+        from yt_dlp import YoutubeDL
+        if not self.supported(YoutubeDL):
+            raise AttributeError("YoutubeDL has no cached _request_director/cookiejar")
+        shared = self._shared()
+        ydl = YoutubeDL(params, auto_init=False)
+        ies, ies_instances = dict(shared._ies), ydl._ies_instances  # Copied, ydl replaces classes with instances
+        ydl._ies = ies
+        ydl.__dict__['cookiejar'] = shared.cookiejar
+        ydl.__dict__['_request_director'] = shared._request_director
+
+        def get_info_extractor(ie_key):
+            ie = ies_instances.get(ie_key)
+            if ie is None:
+                ie = copy.copy(self._extractor(ie_key))
+                ydl.add_info_extractor(ie)  # Binds the copy to ydl
+            return ie
+
+        ydl.get_info_extractor = get_info_extractor
+        return ydl
+
+    def _extractor(self, ie_key):
+        with self._lock:
+            ie = self._extractors.get(ie_key)
+            if ie is None:
+                from yt_dlp.extractor import get_info_extractor
+                ie = self._extractors[ie_key] = get_info_extractor(ie_key)()
+            return ie
+
+    @contextmanager
+    def open(self, params):
+        """
+        Yields a YoutubeDL for `params` attached to the shared state. Network options in `params`
+        are ignored, the shared request director was built from the session's own.
+        """
+        from yt_dlp import YoutubeDL
+        ydl = None
+        if self.shared is not False:
+            try:
+                ydl = self._attached(params)
+                self.shared = True
+            except (AttributeError, TypeError, KeyError):
+                self.shared = False  # Not retried, every job gets a plain YoutubeDL from now on
+        if ydl is None:
+            with YoutubeDL(params) as ydl:
+                yield ydl
+            return
+        try:
+            yield ydl
+        finally:
+            # close() would close the shared director
+            ydl.__dict__.pop('_request_director', None)
+            ydl.close()
+
+    def close(self):
+        with self._lock:
+            if self._ydl is not None:
+                self._ydl.close()
+                self._ydl = None
+            self._extractors.clear()
+
+YTDL_SESSION = YoutubeDLSession()
+
+def codec_name(vcodec):
+    """
+    Returns the output codec name (a VIDEO_ENCODERS key) of a yt-dlp vcodec, or its short form (e.g. "AV01").
+    """
+    for codec in CODEC_FAMILIES:
+        if codec_matches(vcodec, codec):
+            return codec
+    return (vcodec or "unknown").split(".")[0].upper()
+
+def compatible_format_selector(codec, max_height=None):
+    """
+    Returns a yt-dlp format selector for the best video that can be stream-copied to codec,
+    falling back to the best video. Used where no info dict is at hand (CLI, playlist entries).
+    """
+    height = f"[height<={max_height}]" if max_height else ""
+    if codec not in CODEC_FAMILIES:
+        return f"bestvideo{height}"
+    alternatives = [f"bestvideo{height}[vcodec^={prefix}]" for prefix in CODEC_FAMILIES[codec]]
+    # Parenthesized so the job's "+bestaudio" applies to whichever alternative matched
+    return "(" + "/".join(alternatives + [f"bestvideo{height}"]) + ")"
+
+class FormatIndex:
+    """
+    The video formats of one info dict, deduplicated by resolution, frame rate and codec, each
+    with its estimated download size (including the best audio if the format has none) and bitrate.
+    Built once per video; choices() and best_compatible() rank it for an output codec.
+    """
+    def __init__(self, info):
+        duration = info.get('duration')
+        audio_size = max((self.estimate_size(fmt, duration) or 0 for fmt in info.get('formats') or []
+                          if fmt.get('vcodec') == 'none' and fmt.get('acodec') not in (None, 'none')), default=0)
+        groups = {}  # (height, fps, codec) -> choice
+        for fmt in info.get('formats') or []:
+            if fmt.get('vcodec') == 'none' or not fmt.get('height'):
+                continue
+            has_audio = fmt.get('acodec') not in (None, 'none')
+            size = self.estimate_size(fmt, duration)
+            choice = {
+                'format_id': fmt['format_id'],
+                'height': fmt['height'],
+                'fps': round(fmt['fps']) if fmt.get('fps') else None,
+                'codec': codec_name(fmt.get('vcodec')),
+                'vcodec': fmt.get('vcodec'),
+                'ext': fmt.get('ext'),
+                'protocol': fmt.get('protocol'),
+                'tbr': fmt.get('tbr') or fmt.get('vbr'),
+                'size': size + (0 if has_audio else audio_size) if size else None,
+            }
+            key = (choice['height'], choice['fps'], choice['codec'])
+            # Of near-duplicates (e.g. the same stream over DASH and HLS) keep the most direct, then the richest
+            if key not in groups or self.preference(choice) < self.preference(groups[key]):
+                groups[key] = choice
+        self.formats = list(groups.values())
+
+    @staticmethod
+    def estimate_size(fmt, duration):
+        if fmt.get('filesize') or fmt.get('filesize_approx'):
+            return fmt.get('filesize') or fmt.get('filesize_approx')
+        if fmt.get('tbr') and duration:
+            return int(fmt['tbr'] * 1000 / 8 * duration)
+        return None
+
+    @staticmethod
+    def preference(choice):
+        protocol = choice['protocol']
+        rank = PROTOCOL_PREFERENCE.index(protocol) if protocol in PROTOCOL_PREFERENCE else len(PROTOCOL_PREFERENCE)
+        return rank, -(choice['tbr'] or 0)
+
+    @staticmethod
+    def copyable(choice, codec):
+        return codec not in CODEC_FAMILIES or codec_matches(choice['vcodec'], codec)
+
+    def choices(self, codec):
+        """
+        Returns (choice, copyable) pairs, highest resolution and frame rate first; at each of them
+        formats that can be stream-copied to codec come first, then the higher bitrates.
+        """
+        ranked = sorted(self.formats, key=lambda c: (-c['height'], -(c['fps'] or 0), not self.copyable(c, codec),
+                                                     -(c['tbr'] or 0)))
+        return [(choice, self.copyable(choice, codec)) for choice in ranked]
+
+    def best_compatible(self, codec, max_height=None):
+        """
+        Returns the best choice that needs no re-encode to codec, or None if every format would.
+        """
+        for choice, copyable in self.choices(codec):
+            if copyable and (not max_height or choice['height'] <= max_height):
+                return choice
+        return None
+
+    def auto(self, codec, max_height=None):
+        """
+        Returns the choice FORMAT_AUTO stands for: the best compatible one, or if every format
+        needs a re-encode, the best one, both at most max_height high. None if there are no
+        such video formats.
+        """
+        choices = [choice for choice, _ in self.choices(codec) if not max_height or choice['height'] <= max_height]
+        return self.best_compatible(codec, max_height) or (choices[0] if choices else None)
+
+def auto_format(max_height=None):
+    """
+    Returns FORMAT_AUTO limited to formats at most max_height high, e.g. "auto[height<=1080]".
+    """
+    return f"{FORMAT_AUTO}[height<={max_height}]" if max_height else FORMAT_AUTO
+
+def resolve_format(selected_format, codec, index=None):
+    """
+    Turns FORMAT_AUTO (with or without a height limit, see auto_format()) into a format id from
+    the video's FormatIndex when there is one, or into a format selector otherwise. Other formats
+    are returned unchanged.
+    """
+    match = AUTO_FORMAT_PATTERN.fullmatch(selected_format or "")
+    if not match:
+        return selected_format
+    max_height = int(match[1]) if match[1] else None
+    choice = index.auto(codec, max_height) if index else None
+    return choice['format_id'] if choice else compatible_format_selector(codec, max_height)
+
+def is_playlist(info):
+    return info.get('_type') in ('playlist', 'multi_video')
+
+def entry_url(entry):
+    """
+    Returns the URL to download a flat playlist entry from.
+    """
+    return entry.get('webpage_url') or entry.get('url') or entry.get('original_url')
+
+def iter_playlist_entries(entries):
+    """
+    Yields downloadable flat entries. Entries may be a list, generator or paged list;
+    nested playlists are flattened.
+    """
+    for entry in entries:
+        if not entry:
+            continue
+        if entry.get('_type') == 'playlist':
+            yield from iter_playlist_entries(entry.get('entries') or [])
+        elif entry_url(entry):
+            yield entry
+
+def probe_url(url, on_playlist=None, on_entries=None, cancelled=lambda: False):
+    """
+    Extracts info for a URL without downloading anything.
+    Single videos are fully processed, cached in INFO_CACHE and returned. Playlists are extracted
+    flat and streamed instead: on_playlist(info) is called first (without 'entries'), then
+    on_entries(batch) as entries are listed, and None is returned. Raises on extraction errors.
+    The processed info carries yt-dlp's default format selection, so the unprocessed extractor
+    result is kept in it as '__ud_ie_result' for downloads to run their own format selection on.
+    """
+    info = INFO_CACHE.get(url)
+    if info is not None:
+        return info
+    start = time.perf_counter()
+    with YTDL_SESSION.open({'quiet': True, 'extract_flat': 'in_playlist'}) as ydl:
+        # process=False keeps playlist entries as a lazy iterator instead of resolving them all
+        info = ydl.extract_info(url, download=False, process=False)
+        if not is_playlist(info):
+            # Processing changes the dict in place. URL results are resolved by another extractor
+            # while processing, their unprocessed result isn't available to keep
+            ie_result = copy.deepcopy(info) if info.get('_type', 'video') == 'video' else None
+            info = ydl.process_ie_result(info, download=False)
+            if ie_result is not None:
+                info['__ud_ie_result'] = ie_result
+        if is_playlist(info):
+            # Entries must be iterated while ydl is open, paged extractors fetch them on demand
+            stream_playlist(info, on_playlist, on_entries, cancelled)
+            return None
+    # Reported in the metrics of the job downloading it; yt-dlp drops '__' keys from written info
+    info['__ud_extract_seconds'] = time.perf_counter() - start
+    INFO_CACHE.put(url, info)
+    return info
+
+def stream_playlist(info, on_playlist, on_entries, cancelled):
+    if on_playlist:
+        on_playlist({k: v for k, v in info.items() if k != 'entries'})
+    batch = []
+    last_report = time.monotonic()
+    for entry in iter_playlist_entries(info.get('entries') or []):
+        if cancelled():
+            return
+        batch.append(entry)
+        if len(batch) >= PLAYLIST_BATCH_SIZE or time.monotonic() - last_report > PLAYLIST_BATCH_INTERVAL:
+            if on_entries:
+                on_entries(batch)
+            batch = []
+            last_report = time.monotonic()
+    if batch and on_entries and not cancelled():
+        on_entries(batch)
+
+def make_archive_id(extractor, video_id):
+    # Same format as yt_dlp.utils.make_archive_id, without importing yt-dlp
+    return f"{extractor.lower()} {video_id}"
+
+def archive_key(info):
+    """
+    Returns the archive key ("<extractor> <video id>", as in yt-dlp's own archive) of an info dict
+    or flat playlist entry. Generic pages are keyed by URL since their IDs are only file names.
+    """
+    extractor = info.get('extractor_key') or info.get('ie_key')
+    if extractor == 'Generic':
+        return make_archive_id(extractor, info.get('webpage_url') or info.get('url'))
+    if extractor and info.get('id'):
+        return make_archive_id(extractor, info['id'])
+    return None
+
+@lru_cache(maxsize=1024)
+def archive_key_for_url(url):
+    """
+    Returns the archive key of a URL from the extractors' URL patterns alone, without any network
+    access. Returns None if the URL doesn't contain the video ID (e.g. short links).
+    """
+    from yt_dlp.extractor import gen_extractor_classes
+    for ie in gen_extractor_classes():
+        if ie.ie_key() != 'Generic' and ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            return make_archive_id(ie.ie_key(), video_id) if video_id else None
+    return make_archive_id('Generic', url)
+
+def archive_codec(selected_format, selected_codec, audio_mode):
+    """
+    Returns the value stored in the archive's codec column: the output video codec, or the audio
+    mode for audio downloads.
+    """
+    return audio_mode if selected_format == "bestaudio" else selected_codec
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class DownloadArchive:
+    """
+    SQLite index of downloads keyed by archive key, format and codec. Records the stage each job
+    reached, so finished items are skipped and interrupted ones resumed on the next run, and the
+    output path, size and SHA-256 once a job is done. Use open() to share one connection per file.
+    """
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS downloads ("
+                " key TEXT NOT NULL, format TEXT NOT NULL, codec TEXT NOT NULL, stage TEXT NOT NULL,"
+                " url TEXT, path TEXT, vcodec TEXT, size INTEGER, sha256 TEXT, updated REAL,"
+                " PRIMARY KEY (key, format, codec))"
+            )
+
+    @classmethod
+    def open(cls, path):
+        path = os.path.abspath(path)
+        with cls._instances_lock:
+            if path not in cls._instances:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                cls._instances[path] = cls(path)
+            return cls._instances[path]
+
+    def get(self, key, selected_format, codec):
+        """
+        Returns the record for a download as a dict, or None if it was never started.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM downloads WHERE key = ? AND format = ? AND codec = ?", (key, selected_format, codec)
+            ).fetchone()
+        return dict(row) if row else None
+
+    @staticmethod
+    def output_intact(record):
+        """
+        Returns True if a done record's output file still exists with its recorded size. Outputs of
+        other formats or codecs of the same video share the path and may have replaced it.
+        """
+        try:
+            size = os.path.getsize(record['path'] or "")
+        except OSError:
+            return False
+        return record['size'] is None or size == record['size']
+
+    def is_done(self, key, selected_format, codec):
+        record = self.get(key, selected_format, codec)
+        return bool(record) and record['stage'] == STAGE_DONE and self.output_intact(record)
+
+    def record(self, key, selected_format, codec, stage, **fields):
+        """
+        Inserts or updates a download's record. Columns not given keep their stored values.
+        """
+        columns = {'stage': stage, 'updated': time.time(), **fields}
+        names = ", ".join(columns)
+        placeholders = ", ".join("?" for _ in columns)
+        updates = ", ".join(f"{name} = excluded.{name}" for name in columns)
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"INSERT INTO downloads (key, format, codec, {names}) VALUES (?, ?, ?, {placeholders})"
+                f" ON CONFLICT (key, format, codec) DO UPDATE SET {updates}",
+                (key, selected_format, codec, *columns.values())
+            )
+
+# A single download/encode/tag job, independent of any GUI toolkit
+class DownloadJob:
+    """
+    Runs in two stages on caller-provided threads: run() downloads and, if more work is needed,
+    calls on_downloaded(); postprocess() then re-encodes or tags the file. Every outcome ends with
+    exactly one on_finished(success, message) call.
+    With use_archive, each stage is recorded in a DownloadArchive (by default in the save directory)
+    and run() first skips downloads that are already done or resumes them at the recorded stage.
+    Stage timings, bytes and CPU time are collected in self.metrics (JobMetrics).
+    The streams of a merged format are downloaded in parallel, each with concurrent fragment
+    downloads, using up to self.connections connections (set by the scheduler, see wanted_connections()).
+    The scheduler also sets the shared bandwidth cap, the encoder threads and the ffmpeg priority.
+    """
+    def __init__(self, url, save_path, selected_format, selected_codec, download_thumbnail=False, info=None,
+                 encode_mode=ENCODE_STANDARD, audio_mode=AUDIO_MP3,
+                 thumbnail_max_edge=THUMBNAIL_MAX_EDGE, thumbnail_quality=THUMBNAIL_JPEG_QUALITY, quiet=False,
+                 use_archive=False, archive_path=None, concurrent_fragments=CONCURRENT_FRAGMENTS,
+                 parallel_streams=True, encoder_profile=PROFILE_BALANCED):
+        self.url = url
+        self.info = info  # Info dict from probing, reused to avoid a second extraction
+        self.save_path = save_path
+        self.selected_format = selected_format
+        self.selected_codec = selected_codec
+        self.download_thumbnail = download_thumbnail
+        self.encode_mode = encode_mode
+        self.encoder_profile = encoder_profile
+        self.audio_mode = audio_mode
+        self.thumbnail_max_edge = thumbnail_max_edge
+        self.thumbnail_quality = thumbnail_quality
+        self.thumbnail_data = None  # Raw thumbnail bytes fetched during the download stage
+        self.is_video = self.selected_format != "bestaudio"
+        self.download_max_progress = 90 if self.is_video else 100  # Reserve 10% for re-encoding if video
+        self.files_progress = {}  # filename -> [downloaded bytes, total bytes]
+        self.total_download_bytes = 0  # Running totals over files_progress
+        self.downloaded_bytes = 0
+        self.last_progress = None  # Last reported percentage and when it was sent
+        self.last_progress_time = 0.0
+        self.speed = None  # Smoothed download speed in bytes/s
+        self.speed_sample = None  # (time, downloaded bytes) at the last speed update
+        self.downloaded_file = None
+        self.copy_video = False  # Set when the source video already has the selected codec
+        self.source_duration = None  # Seconds and codecs of the download from its info dict, save an ffprobe call
+        self.source_video_codec = None
+        self.source_audio_codec = None
+        self.quiet = quiet
+        self.concurrent_fragments = max(1, concurrent_fragments)
+        self.parallel_streams = parallel_streams
+        self.connections = self.wanted_connections()  # Lowered by the scheduler to fit its connection budget
+        self.progress_lock = threading.Lock()  # Parallel streams report progress from their own threads
+        self.streams_cancelled = threading.Event()  # Set to abort the streams still downloading in the background
+        self.bandwidth = None  # TokenBucket shared with the other downloads, None for no cap
+        self.encoder_threads = None  # ffmpeg -threads for encodes, None for ffmpeg's default
+        self.priority = PRIORITY_NORMAL  # Of the ffmpeg/ffprobe processes started by the job
+        self.archive = None
+        if use_archive:
+            self.archive = DownloadArchive.open(archive_path or os.path.join(save_path, ARCHIVE_FILENAME))
+        self.archive_key = None
+        self.archive_codec = archive_codec(selected_format, selected_codec, audio_mode)
+        self.metrics = JobMetrics()
+        self.cpu_mark = 0.0  # Thread CPU time when the current stage's thread was last accounted
+        self.postprocessor_start = None
+        self.merge_encode = False  # Encoding while yt-dlp merges, on the download thread
+        self.encoder_wait = 0.0  # Seconds the download thread waited for an encoder slot before merging
+        # Callbacks, invoked from the thread running the current stage
+        self.on_log = lambda msg: None               # Log messages
+        self.on_progress = lambda value: None        # Percent complete, only sent when it changes
+        self.on_speed = lambda speed, eta: None      # Download speed in bytes/s and seconds left (None if unknown)
+        self.on_finished = lambda success, msg: None # Completion status
+        self.on_downloaded = lambda: None            # Download stage done, post-processing still pending
+        self.on_connections = lambda count: None     # Fewer connections needed than granted: once formats are selected, 0 when merging
+        self.on_merging = lambda: None               # Merge mode: streams complete, returns once an encoder slot is free
+
+    def wanted_connections(self):
+        """
+        Returns the number of connections the download stage can use: the fragment concurrency
+        for each stream, times two when the video and audio streams are fetched in parallel.
+        """
+        streams = 2 if self.is_video and self.parallel_streams else 1
+        return self.concurrent_fragments * streams
+
+    def source_vcodec(self, info):
+        """
+        Returns the vcodec of the downloaded video stream from a processed info dict, or None if unknown.
+        """
+        for fmt in info.get('requested_formats') or [info]:
+            if fmt.get('vcodec') not in (None, 'none'):
+                return fmt['vcodec']
+        return None
+
+    def downloaded_now(self, info):
+        """
+        Returns False if yt-dlp found the output file already on disk and downloaded nothing; the
+        file may then have been made from other formats than the info dict describes.
+        """
+        return any(download.get('__real_download') for download in info.get('requested_downloads') or [info])
+
+    def source_acodec(self, info):
+        """
+        Returns the acodec of the downloaded audio stream from a processed info dict, or None if unknown.
+        """
+        for fmt in info.get('requested_formats') or [info]:
+            if fmt.get('acodec') not in (None, 'none'):
+                return fmt['acodec']
+        return None
+
+    def run(self):
+        self.cpu_mark = time.thread_time()
+        if self.archive and self.check_archive():
+            return
+        if self.is_video:
+            ydl_opts = {
+                'format': f"{self.selected_format}+bestaudio/best",
+                'outtmpl': os.path.join(self.save_path, "%(title)s.%(ext)s"),
+                'progress_hooks': [self.progress_hook],
+                'postprocessor_hooks': [self.postprocessor_hook],
+                'merge_output_format': 'mp4',
+                'continuedl': True,  # Resume from .part files left by an interrupted run
+            }
+            # Settled by prepare_merge() once the formats are selected
+            self.merge_encode = self.encode_mode == ENCODE_MERGE and self.selected_codec in VIDEO_ENCODERS
+            info = self.download_with_ydl(ydl_opts)
+            if info:
+                downloaded_now = self.downloaded_now(info)
+                if not downloaded_now:
+                    self.copy_video = False  # The existing file is probed in post-processing instead
+                if self.merge_encode and info.get('requested_formats') and downloaded_now:
+                    self.report_progress(100)
+                    self.finish(True, "Download and encoding completed successfully!")
+                elif self.selected_codec != "Original" and not self.copy_video:
+                    self.copy_video = downloaded_now and codec_matches(self.source_vcodec(info), self.selected_codec)
+                    if self.copy_video and self.downloaded_file.endswith('.mp4'):
+                        # Merged with stream copy into the right codec and container already
+                        self.on_log(f"Source is already {self.selected_codec}, skipping re-encode")
+                        self.report_progress(100)
+                        self.finish(True, "Download completed successfully!")
+                    else:
+                        # Also reached in merge mode when a single pre-merged format was picked and nothing was merged
+                        self.download_finished(info)  # Re-encode (or remux) in the post-processing pool
+                else:
+                    self.report_progress(100)
+                    self.finish(True, "Download completed successfully!")
+            else:
+                self.finish(False, "Download failed")
+        else:
+            if self.audio_mode == AUDIO_ORIGINAL:
+                # 'best' stream-copies aac to m4a, opus to opus, vorbis to ogg and only transcodes unknown codecs
+                audio_postprocessor = {'key': 'FFmpegExtractAudio', 'preferredcodec': 'best'}
+            else:
+                audio_postprocessor = {'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '320'}
+            ydl_opts = {
+                'format': 'bestaudio',
+                'outtmpl': os.path.join(self.save_path, "%(title)s.%(ext)s"),
+                'postprocessors': [audio_postprocessor],
+                'progress_hooks': [self.progress_hook],
+                'postprocessor_hooks': [self.postprocessor_hook],
+                'continuedl': True,
+            }
+            info = self.download_with_ydl(ydl_opts)
+            if info:
+                if self.download_thumbnail:
+                    self.download_finished(info)  # Embed the thumbnail in the post-processing pool
+                else:
+                    self.report_progress(100)
+                    self.finish(True, "Download completed successfully!")
+            else:
+                self.finish(False, "Download failed")
+
+    def check_archive(self):
+        """
+        Looks the job up in the archive before downloading anything. Returns True if the record
+        settled it: the output already exists, or only post-processing was left and it was handed on.
+        """
+        self.archive_key = archive_key(self.info) if self.info else archive_key_for_url(self.url)
+        if self.archive_key is None:
+            # The URL alone doesn't identify the video, extract its info first (reused by the download)
+            try:
+                self.info = probe_url(self.url)
+                self.metrics.add_stage('extract', self.info.pop('__ud_extract_seconds', 0.0))
+            except Exception:
+                return False  # Let the download report the error
+            self.archive_key = archive_key(self.info) if self.info else None
+            if self.archive_key is None:
+                return False
+        record = self.archive.get(self.archive_key, self.selected_format, self.archive_codec)
+        if record and record['path'] and os.path.exists(record['path']):
+            if record['stage'] == STAGE_DONE and self.archive.output_intact(record):
+                self.downloaded_file = record['path']
+                self.on_log(f"Already downloaded: {record['path']}")
+                self.report_progress(100)
+                self.add_thread_cpu()
+                self.on_finished(True, "Already downloaded, skipped")
+                return True
+            if record['stage'] == STAGE_DOWNLOADED:
+                self.downloaded_file = record['path']
+                self.copy_video = self.is_video and codec_matches(record['vcodec'], self.selected_codec)
+                if self.download_thumbnail:
+                    with self.metrics.stage('thumbnail_fetch'):
+                        self.thumbnail_data = self.refetch_thumbnail()
+                self.on_log(f"Resuming post-processing of {record['path']}")
+                self.report_progress(self.download_max_progress)
+                self.add_thread_cpu()
+                self.on_downloaded()
+                return True
+        if record and record['stage'] == STAGE_DOWNLOADING:
+            self.on_log("Resuming interrupted download")
+        self.archive.record(self.archive_key, self.selected_format, self.archive_codec, STAGE_DOWNLOADING, url=self.url)
+        return False
+
+    def refetch_thumbnail(self):
+        """
+        Fetches the thumbnail for a job resumed after its download stage, when it is no longer in memory.
+        """
+        try:
+            info = self.info or probe_url(self.url)
+            with YTDL_SESSION.open({'quiet': True}) as ydl:
+                return self.fetch_thumbnail(ydl, info)
+        except Exception:
+            return None
+
+    def download_finished(self, info):
+        """
+        Ends the download stage of a job that still needs post-processing.
+        """
+        if self.downloaded_now(info):
+            # Otherwise the file on disk is left unknown, to be probed
+            self.source_duration = info.get('duration')
+            self.source_video_codec = self.source_vcodec(info)
+            self.source_audio_codec = self.source_acodec(info)
+        if self.archive and self.archive_key:
+            self.archive.record(self.archive_key, self.selected_format, self.archive_codec, STAGE_DOWNLOADED,
+                                path=self.downloaded_file, vcodec=self.source_video_codec)
+        self.add_thread_cpu()
+        self.on_downloaded()
+
+    def finish(self, success, msg):
+        """
+        Reports the outcome; successful outputs are recorded in the archive with their size and hash.
+        Metrics are complete once on_finished is called.
+        """
+        if success and self.downloaded_file and os.path.exists(self.downloaded_file):
+            self.metrics.output_bytes = os.path.getsize(self.downloaded_file)
+        if success and self.archive and self.archive_key and self.downloaded_file:
+            try:
+                with self.metrics.stage('archive'):
+                    self.archive.record(self.archive_key, self.selected_format, self.archive_codec, STAGE_DONE,
+                                        path=self.downloaded_file, size=os.path.getsize(self.downloaded_file),
+                                        sha256=file_sha256(self.downloaded_file))
+            except (OSError, sqlite3.Error) as e:
+                self.on_log(f"Warning: Could not update the download archive: {str(e)}")
+        self.add_thread_cpu()
+        self.on_finished(success, msg)
+
+    def add_thread_cpu(self):
+        # Accounts the CPU time the calling (stage) thread used since the last call or the stage start
+        now = time.thread_time()
+        self.metrics.add_cpu('python', now - self.cpu_mark)
+        self.cpu_mark = now
+
+    def postprocess(self):
+        """
+        CPU-bound stage run after the download stage called on_downloaded().
+        """
+        self.cpu_mark = time.thread_time()
+        if self.is_video:
+            self.reencode_video()
+            return
+        if self.thumbnail_data:
+            with self.metrics.stage('thumbnail_convert'):
+                cover = self.prepare_thumbnail(self.thumbnail_data)
+            self.thumbnail_data = None
+            if cover:
+                with self.metrics.stage('tagging'):
+                    self.embed_thumbnail(self.downloaded_file, cover)
+        else:
+            self.on_log("Thumbnail not available")
+        self.report_progress(100)
+        self.finish(True, "Download completed successfully!")
+
+    def download_with_ydl(self, ydl_opts):
+        if self.quiet:
+            ydl_opts.update({'quiet': True, 'noprogress': True})
+        cached_info = self.info or INFO_CACHE.get(self.url)
+        # The processed info holds the probe's format selection, which a new selection may not replace
+        ie_result = cached_info.get('__ud_ie_result') if cached_info else None
+        try:
+            with YTDL_SESSION.open(ydl_opts) as ydl:
+                self.parallelize_streams(ydl)
+                if ie_result:
+                    # Popped from the shared (cached) dict, so only the first job using it counts the probe
+                    self.metrics.add_stage('extract', cached_info.pop('__ud_extract_seconds', 0.0))
+                    info = copy.deepcopy(ie_result)
+                else:
+                    with self.metrics.stage('extract'):
+                        info = ydl.extract_info(self.url, download=False)
+                # Run format selection and download on the extracted info
+                start = time.perf_counter()
+                postprocessors_before = self.postprocessor_seconds() + self.encoder_wait
+                info = ydl.process_ie_result(info, download=True)
+                # yt-dlp's own postprocessors (merge, audio extraction) run inside the call, count them separately
+                self.metrics.add_stage('download', time.perf_counter() - start
+                                       - (self.postprocessor_seconds() + self.encoder_wait - postprocessors_before))
+                self.downloaded_file = ydl.prepare_filename(info)
+                # Postprocessors (audio extraction, merging) may change the extension, use the final path
+                requested_downloads = info.get('requested_downloads') or []
+                if requested_downloads and requested_downloads[-1].get('filepath'):
+                    self.downloaded_file = requested_downloads[-1]['filepath']
+                if self.download_thumbnail:
+                    # Fetched here so the network work stays in the download stage
+                    with self.metrics.stage('thumbnail_fetch'):
+                        self.thumbnail_data = self.fetch_thumbnail(ydl, info)
+                return info
+        except Exception as e:
+            self.on_log(f"Error: {str(e)}")
+            return None
+
+    def prepare_merge(self, ydl, info_dict):
+        """
+        In merge mode, makes the merger of the selected formats apply the encoder instead of
+        stream-copying, unless the selected video already has the requested codec.
+        """
+        if not self.merge_encode or not info_dict.get('requested_formats'):
+            return
+        if codec_matches(self.source_vcodec(info_dict), self.selected_codec):
+            # The merger's default stream copy already produces the requested codec
+            self.merge_encode = False
+            self.copy_video = True
+            self.on_log(f"Source is already {self.selected_codec}, skipping re-encode")
+            return
+        video_args, audio_args = encoder_args(self.selected_codec, self.encoder_profile, self.source_acodec(info_dict))
+        # Read by the merger when it runs
+        ydl.params['postprocessor_args'] = {'merger+ffmpeg_o': [*video_args, *self.thread_args(), *audio_args]}
+        self.on_log(f"Encoding to {self.selected_codec} ({self.encoder_profile}) while merging")
+
+    def parallelize_streams(self, ydl):
+        """
+        Makes ydl fetch the streams of a merged format (video + audio) at the same time and splits
+        the job's connections between them as concurrent fragment downloads.
+        yt-dlp downloads requested formats one after the other: when it starts the first one, the
+        others are started in the background under the file names yt-dlp will use for them, and
+        its own download call for each of them then waits for that download instead.
+        """
+        process_info, dl = ydl.process_info, ydl.dl
+        state = {'info': None, 'executor': None, 'prefetched': {}}  # prefetched: filename -> Future of dl()
+
+        def parallel_process_info(info_dict):
+            self.prepare_merge(ydl, info_dict)
+            formats = info_dict.get('requested_formats') or []
+            parallel = self.parallel_streams and len(formats) > 1 and self.connections >= len(formats)
+            fragments = max(1, self.connections // (len(formats) if parallel else 1))
+            ydl.params['concurrent_fragment_downloads'] = fragments
+            # Hand back connections the selected formats can't use, e.g. for a single plain HTTP file
+            counts = [fragments if fmt.get('protocol') in FRAGMENTED_PROTOCOLS else 1 for fmt in formats or [info_dict]]
+            needed = sum(counts) if parallel else max(counts)
+            if needed < self.connections:
+                self.connections = needed
+                self.on_connections(needed)
+            state['info'] = info_dict if parallel else None
+            try:
+                return process_info(info_dict)
+            except BaseException:
+                # The first stream failed: stop the others at their next progress hook instead of
+                # waiting for them to complete
+                self.streams_cancelled.set()
+                raise
+            finally:
+                # Don't leave downloads writing in the background
+                if state['executor']:
+                    state['executor'].shutdown(wait=True, cancel_futures=True)
+                self.streams_cancelled.clear()
+                state.update(info=None, executor=None, prefetched={})
+
+        def prefetch(filename, stream_info):
+            cpu_start = time.thread_time()
+            try:
+                return dl(filename, stream_info)
+            finally:
+                self.metrics.add_cpu('python', time.thread_time() - cpu_start)
+
+        def parallel_dl(name, info, subtitle=False, test=False):
+            if subtitle or test:
+                return dl(name, info, subtitle, test)
+            if name in state['prefetched']:
+                return state['prefetched'].pop(name).result()
+            info_dict, state['info'] = state['info'], None
+            if info_dict:
+                first, *others = info_dict['requested_formats']
+                suffix = f".f{first['format_id']}.{info['ext']}"
+                if info.get('format_id') == first['format_id'] and name.endswith(suffix):
+                    # Same naming as yt-dlp: <temp name without extension>.f<format id>.<format ext>
+                    base = name[:-len(suffix)]
+                    state['executor'] = ThreadPoolExecutor(max_workers=len(others), thread_name_prefix="stream")
+                    for fmt in others:
+                        stream_info = {k: v for k, v in info_dict.items() if k != 'requested_formats'}
+                        stream_info.update(fmt)
+                        filename = f"{base}.f{fmt['format_id']}.{stream_info['ext']}"
+                        state['prefetched'][filename] = state['executor'].submit(prefetch, filename, stream_info)
+            return dl(name, info, subtitle, test)
+
+        ydl.process_info = parallel_process_info
+        ydl.dl = parallel_dl
+
+    def postprocessor_hook(self, d):
+        if d['status'] == 'started':
+            if d.get('postprocessor') == 'Merger' and self.connections:
+                # The streams are complete; in merge mode the encode still runs on the download thread
+                self.connections = 0
+                self.on_connections(0)
+            if d.get('postprocessor') == 'Merger' and self.merge_encode:
+                # The encode counts against the post-processing slots and their encoder threads
+                wait_start = time.perf_counter()
+                self.on_merging()
+                self.encoder_wait += time.perf_counter() - wait_start
+            self.postprocessor_start = time.perf_counter()
+        elif d['status'] == 'finished' and self.postprocessor_start is not None:
+            stage = YTDLP_POSTPROCESSOR_STAGES.get(d.get('postprocessor'), 'ytdlp_other')
+            self.metrics.add_stage(stage, time.perf_counter() - self.postprocessor_start)
+            self.postprocessor_start = None
+
+    def postprocessor_seconds(self):
+        stages = self.metrics.stages
+        return sum(stages.get(stage, 0.0) for stage in (*YTDLP_POSTPROCESSOR_STAGES.values(), 'ytdlp_other'))
+
+    def progress_hook(self, d):
+        if self.streams_cancelled.is_set():
+            from yt_dlp.utils import DownloadCancelled
+            raise DownloadCancelled("Another stream of the format failed")
+        with self.progress_lock:
+            received = self.update_download_progress(d)
+        if received and self.bandwidth:
+            # yt-dlp reads the next chunk only after the hooks return, so waiting here throttles this stream
+            self.bandwidth.consume(received)
+
+    def update_download_progress(self, d):
+        """
+        Applies a progress hook call to the byte totals and reports progress. Returns the bytes
+        received since the file's previous call (0 for its first, which may include resumed data).
+        """
+        filename = d['filename']
+        if d['status'] == 'finished':
+            self.metrics.add_stream(filename, d.get('total_bytes') or d.get('downloaded_bytes'), d.get('elapsed'))
+        if d['status'] == 'downloading':
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            downloaded = d['downloaded_bytes']
+        elif d['status'] == 'finished' and filename in self.files_progress:
+            total = downloaded = d.get('total_bytes') or d.get('downloaded_bytes') or self.files_progress[filename][1]
+        else:
+            return 0
+        received = downloaded - self.files_progress[filename][0] if filename in self.files_progress else 0
+        if filename not in self.files_progress:
+            if not total:
+                return 0
+            self.files_progress[filename] = [0, 0]
+        # Only this file's change is applied to the totals, yt-dlp calls this for every received chunk
+        file_progress = self.files_progress[filename]
+        if total and total != file_progress[1]:
+            # Fragmented downloads refine their size estimate as fragments arrive
+            self.total_download_bytes += total - file_progress[1]
+            file_progress[1] = total
+        self.downloaded_bytes += downloaded - file_progress[0]
+        file_progress[0] = downloaded
+        finished = d['status'] == 'finished'
+        now = time.monotonic()
+        if finished or self.speed_sample is None or now - self.speed_sample[0] >= PROGRESS_INTERVAL:
+            self.update_speed(now)
+            download_progress = min(self.downloaded_bytes / self.total_download_bytes, 1) * self.download_max_progress
+            # Streams whose size is not known yet (e.g. the audio of a merged format) can make the ratio drop
+            download_progress = max(int(download_progress), self.last_progress or 0)
+            self.report_progress(download_progress, throttle=not finished)
+        return received
+
+    def update_speed(self, now):
+        """
+        Updates the smoothed speed from the byte counters and reports it with the estimated time left.
+        """
+        if self.speed_sample is not None:
+            sample_time, sample_bytes = self.speed_sample
+            if now - sample_time < PROGRESS_INTERVAL / 2:
+                return  # Too short to measure, e.g. a 'finished' report right after a regular one
+            current = (self.downloaded_bytes - sample_bytes) / (now - sample_time)
+            self.speed = current if self.speed is None else self.speed + SPEED_SMOOTHING * (current - self.speed)
+            remaining = max(self.total_download_bytes - self.downloaded_bytes, 0)
+            self.on_speed(self.speed, remaining / self.speed if self.speed > 0 else None)
+        # Also the baseline for the first sample, bytes resumed from .part files don't count as speed
+        self.speed_sample = (now, self.downloaded_bytes)
+
+    def report_progress(self, value, throttle=False):
+        """
+        Sends a percentage through on_progress if it changed. Throttled reports are dropped when
+        the previous one was sent less than PROGRESS_INTERVAL ago.
+        """
+        if value == self.last_progress:
+            return
+        now = time.monotonic()
+        if throttle and now - self.last_progress_time < PROGRESS_INTERVAL:
+            return
+        self.last_progress = value
+        self.last_progress_time = now
+        self.on_progress(value)
+
+    def reencode_video(self):
+        if self.copy_video:
+            self.remux_video()
+            return
+        base, _ = os.path.splitext(self.downloaded_file)
+        output_file = f"{base}_{self.selected_codec}.mp4"
+        if self.selected_codec not in VIDEO_ENCODERS:
+            self.finish(False, "Unsupported codec selected")
+            return
+
+        # Duration for the progress, codecs to decide what can be copied. They come from the info dict;
+        # ffprobe is only run when it lacks them, e.g. for direct file URLs or jobs resumed from the archive
+        duration, acodec = self.source_duration, self.source_audio_codec
+        if (not duration or self.source_video_codec is None
+                or (acodec is None and PROFILE_AUDIO_COPY[self.encoder_profile])):
+            try:
+                duration, vcodec, acodec = self.probe_media()
+            except Exception as e:
+                self.on_log(f"Failed to get duration: {str(e)}")
+                self.finish(False, "Re-encoding failed")
+                return
+            if codec_matches(vcodec, self.selected_codec):
+                self.copy_video = True
+                self.remux_video()
+                return
+
+        video_args, audio_args = encoder_args(self.selected_codec, self.encoder_profile, acodec)
+        self.on_log(f"Encoding to {self.selected_codec} ({self.encoder_profile})")
+        with self.metrics.stage('reencode'):
+            if self.encode_mode == ENCODE_SEGMENTED and duration >= 2 * SEGMENT_MIN_SECONDS:
+                returncode = self.reencode_segmented(video_args, audio_args, duration, output_file)
+            else:
+                cmd = [
+                    get_ffmpeg_path("ffmpeg"), "-i", self.downloaded_file, *video_args,
+                    *self.thread_args(), *audio_args, "-y", "-progress", "pipe:1", output_file
+                ]
+                returncode = run_ffmpeg_with_progress(cmd, lambda t: self.report_reencode_progress(t, duration),
+                                                      self.metrics, self.priority)
+        if returncode == 0:
+            # Replace the original before reporting completion, the queue may start the next job right away
+            try:
+                os.remove(self.downloaded_file)
+                # A single non-mp4 format (e.g. webm) also ends up as .mp4 after re-encoding
+                self.downloaded_file = base + ".mp4"
+                os.rename(output_file, self.downloaded_file)
+            except Exception as e:
+                self.on_log(f"Warning: Could not replace original file: {str(e)}")
+            self.report_progress(100)
+            self.finish(True, "Re-encoding completed successfully!")
+        else:
+            self.finish(False, "Re-encoding failed")
+
+    def probe_media(self):
+        """
+        Returns the duration and the codecs of the first video and audio streams (None if there is
+        none) of the downloaded file from ffprobe.
+        """
+        cmd = [get_ffmpeg_path("ffprobe"), "-v", "error", "-show_entries",
+               "format=duration:stream=codec_type,codec_name", "-of", "json", self.downloaded_file]
+        with self.metrics.stage('ffprobe'):
+            returncode, output = run_tool(cmd, self.metrics, capture=True, priority=self.priority)
+        if returncode != 0:
+            raise RuntimeError(f"ffprobe exited with code {returncode}")
+        probe = json.loads(output)
+        codecs = {}
+        for stream in probe.get('streams') or []:
+            codecs.setdefault(stream.get('codec_type'), stream.get('codec_name'))
+        return float(probe['format']['duration']), codecs.get('video'), codecs.get('audio')
+
+    def remux_video(self):
+        """
+        Stream-copies a download whose video codec already matches into an mp4 container.
+        """
+        if self.downloaded_file.endswith('.mp4'):
+            # Resumed from the archive, or the codec was only found by ffprobe; run() finishes matching mp4 downloads itself
+            self.on_log(f"Source is already {self.selected_codec}, skipping re-encode")
+            self.report_progress(100)
+            self.finish(True, "Download completed successfully!")
+            return
+        self.on_log(f"Source is already {self.selected_codec}, remuxing to mp4 without re-encoding")
+        base, _ = os.path.splitext(self.downloaded_file)
+        output_file = base + ".mp4"
+        cmd = [get_ffmpeg_path("ffmpeg"), "-i", self.downloaded_file, "-map", "0", "-c", "copy", "-y", output_file]
+        with self.metrics.stage('remux'):
+            returncode, _ = run_tool(cmd, self.metrics, priority=self.priority)
+        if returncode != 0:
+            self.finish(False, "Remux failed")
+            return
+        try:
+            os.remove(self.downloaded_file)
+            self.downloaded_file = output_file
+        except Exception as e:
+            self.on_log(f"Warning: Could not remove original file: {str(e)}")
+        self.report_progress(100)
+        self.finish(True, "Remux completed successfully!")
+
+    def thread_args(self):
+        return ["-threads", str(self.encoder_threads)] if self.encoder_threads else []
+
+    def report_reencode_progress(self, current_time, duration):
+        if duration > 0:
+            reencode_progress = 90 + min(current_time / duration, 1) * 10
+            self.report_progress(int(reencode_progress), throttle=True)
+
+    def reencode_segmented(self, video_args, audio_args, duration, output_file):
+        """
+        Splits the video stream at keyframes, encodes the segments in parallel ffmpeg processes
+        (one per core, at most one per encoder thread of the job) and joins them losslessly with
+        the concat demuxer. Audio is encoded (or copied) once from the original file during the
+        join. Returns 0 on success like an ffmpeg exit code.
+        """
+        workers = min(os.cpu_count() or 1, self.encoder_threads or os.cpu_count() or 1)
+        segment_threads = max(1, (self.encoder_threads or workers) // workers)
+        segment_time = max(SEGMENT_MIN_SECONDS, duration / (workers * SEGMENTS_PER_WORKER))
+        work_dir = tempfile.mkdtemp(prefix=".ud_segments_", dir=os.path.dirname(output_file) or ".")
+        try:
+            # Stream copy splits can only cut at keyframes, which is exactly what independent encodes need
+            cmd = [
+                get_ffmpeg_path("ffmpeg"), "-i", self.downloaded_file, "-map", "0:v:0", "-c", "copy",
+                "-f", "segment", "-segment_time", f"{segment_time:.3f}", "-reset_timestamps", "1",
+                "-y", os.path.join(work_dir, "src_%05d.mkv")
+            ]
+            if run_tool(cmd, self.metrics, priority=self.priority)[0] != 0:
+                self.on_log("Failed to split video into segments")
+                return 1
+            sources = sorted(f for f in os.listdir(work_dir) if f.startswith("src_"))
+            self.on_log(f"Encoding {len(sources)} segments on {workers} cores")
+
+            segment_times = {}
+            encoded_time = 0.0  # Sum of segment_times
+            lock = threading.Lock()
+            failed = threading.Event()
+
+            def on_time(source, current_time):
+                nonlocal encoded_time
+                with lock:
+                    encoded_time += current_time - segment_times.get(source, 0.0)
+                    segment_times[source] = current_time
+                    total_time = encoded_time
+                self.report_reencode_progress(total_time, duration)
+
+            def encode_segment(source):
+                if failed.is_set():
+                    return 1
+                cmd = [
+                    get_ffmpeg_path("ffmpeg"), "-i", os.path.join(work_dir, source), *video_args,
+                    "-threads", str(segment_threads), "-an", "-y", "-progress", "pipe:1",
+                    os.path.join(work_dir, source.replace("src_", "enc_"))
+                ]
+                returncode = run_ffmpeg_with_progress(cmd, lambda t: on_time(source, t), self.metrics, self.priority)
+                if returncode != 0:
+                    failed.set()
+                return returncode
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                if any(pool.map(encode_segment, sources)):
+                    self.on_log("Failed to encode a segment")
+                    return 1
+
+            list_file = os.path.join(work_dir, "segments.txt")
+            with open(list_file, "w", encoding="utf-8") as f:
+                for source in sources:
+                    f.write(f"file '{source.replace('src_', 'enc_')}'\n")
+            cmd = [
+                get_ffmpeg_path("ffmpeg"), "-f", "concat", "-safe", "0", "-i", list_file,
+                "-i", self.downloaded_file, "-map", "0:v:0", "-map", "1:a:0?",
+                "-c:v", "copy", *audio_args, "-y", output_file
+            ]
+            return run_tool(cmd, self.metrics, priority=self.priority)[0]
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def fetch_thumbnail(self, ydl, info):
+        """
+        Downloads the preferred thumbnail into memory. yt-dlp sorts info['thumbnails'] from worst
+        to best, so candidates are tried best first and the first one that responds is used.
+        """
+        candidates = [t['url'] for t in reversed(info.get('thumbnails') or []) if t.get('url')]
+        if not candidates and info.get('thumbnail'):
+            candidates = [info['thumbnail']]
+        for url in candidates:
+            try:
+                with ydl.urlopen(url) as response:
+                    return response.read()
+            except Exception:
+                continue  # e.g. maxresdefault missing for older videos
+        return None
+
+    def prepare_thumbnail(self, data):
+        """
+        Decodes thumbnail bytes (webp/jpeg/png), downscales them to the maximum edge and
+        returns them recompressed as JPEG bytes, all in memory.
+        """
+        from PIL import Image
+        try:
+            img = Image.open(BytesIO(data))
+            img.thumbnail((self.thumbnail_max_edge, self.thumbnail_max_edge))
+            buffer = BytesIO()
+            img.convert("RGB").save(buffer, "JPEG", quality=self.thumbnail_quality, optimize=True)
+            return buffer.getvalue()
+        except Exception as e:
+            self.on_log(f"Failed to convert thumbnail: {str(e)}")
+            return None
+
+    def embed_thumbnail(self, audio_file, data, mime="image/jpeg"):
+        """
+        Embeds cover image bytes using the tag format of the audio container:
+        ID3 APIC for mp3, 'covr' atoms for m4a and FLAC picture blocks for flac and Ogg (opus/vorbis).
+        """
+        from mutagen import File as MutagenFile
+        from mutagen.id3 import ID3, APIC
+        from mutagen.mp4 import MP4, MP4Cover
+        from mutagen.flac import FLAC, Picture
+        try:
+            is_jpeg = mime == "image/jpeg"
+            ext = os.path.splitext(audio_file)[1].lower()
+            if ext == ".mp3":
+                audio = ID3(audio_file)
+                audio.add(APIC(
+                    encoding=3,
+                    mime=mime,
+                    type=3,
+                    desc="Cover",
+                    data=data
+                ))
+            elif ext in (".m4a", ".mp4", ".m4b"):
+                audio = MP4(audio_file)
+                image_format = MP4Cover.FORMAT_JPEG if is_jpeg else MP4Cover.FORMAT_PNG
+                audio['covr'] = [MP4Cover(data, imageformat=image_format)]
+            elif ext in (".flac", ".opus", ".ogg", ".oga"):
+                picture = Picture()
+                picture.type = 3
+                picture.mime = mime
+                picture.desc = "Cover"
+                picture.data = data
+                if ext == ".flac":
+                    audio = FLAC(audio_file)
+                    audio.clear_pictures()
+                    audio.add_picture(picture)
+                else:
+                    # Vorbis comments carry the FLAC picture block base64 encoded
+                    audio = MutagenFile(audio_file)
+                    audio['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+            else:
+                self.on_log(f"Embedding thumbnails is not supported for {ext} files")
+                return
+            audio.save()
+            self.on_log("Thumbnail embedded successfully")
+        except Exception as e:
+            self.on_log(f"Failed to embed thumbnail: {str(e)}")
+
+def host_key(url):
+    """
+    Returns the normalized host of a URL, used to limit concurrent jobs per site.
+    """
+    host = (urlparse(url).hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return HOST_ALIASES.get(host, host)
+
+
+class JobScheduler:
+    """
+    Runs DownloadJobs on background threads under global and per-host limits.
+    Jobs are pipelined: once a download finishes its slot is reused for the next download while
+    re-encoding and tagging run in a separate, smaller post-processing pool.
+    Each download is granted part of a global connection budget when it starts, shared with
+    the other jobs that can start at the same time, and returns it when its download stage ends.
+    All downloads draw from one bandwidth cap (bytes/s, 0 for none), and the encoder threads are
+    split evenly between the post-processing slots. Jobs encoding while merging wait for one of
+    those slots too, on their download thread.
+    The on_* callbacks are invoked from whichever thread caused the change.
+    """
+    def __init__(self, max_concurrent=MAX_CONCURRENT_DOWNLOADS, max_per_host=MAX_DOWNLOADS_PER_HOST,
+                 max_postprocess=MAX_CONCURRENT_POSTPROCESS, postprocess_queue_size=POSTPROCESS_QUEUE_SIZE,
+                 max_connections=MAX_CONNECTIONS, bandwidth_limit=0, max_encoder_threads=MAX_ENCODER_THREADS,
+                 priority=PRIORITY_NORMAL):
+        self.max_concurrent = max_concurrent
+        self.bandwidth = TokenBucket(bandwidth_limit)
+        self.max_encoder_threads = max_encoder_threads
+        self.priority = priority  # Of the ffmpeg processes started by jobs
+        self.max_connections = max_connections
+        self.connections = 0      # Connections granted to running downloads
+        self.max_per_host = max_per_host
+        self.max_postprocess = max_postprocess
+        self.postprocess_queue_size = postprocess_queue_size
+        self.jobs = {}            # job id -> job dict
+        self.pending = deque()    # job ids waiting for a slot
+        self.running = set()      # job ids currently downloading
+        self.postprocess_pending = deque()  # downloaded job ids waiting for an encoder
+        self.postprocessing = set()         # job ids currently post-processing
+        self.batch = []           # job ids counted in the aggregate progress
+        self.batch_progress = 0   # Sum of the progress of the jobs in batch
+        self.aggregate = None     # Last reported aggregate progress
+        self.next_id = 1
+        self.lock = threading.RLock()
+        self.idle = threading.Condition(self.lock)
+        self.on_job_added = lambda job_id, label: None
+        self.on_job_status = lambda job_id, status: None     # 'queued', 'running', 'waiting', 'processing', 'done', 'failed'
+        self.on_job_progress = lambda job_id, value: None
+        self.on_job_speed = lambda job_id, speed, eta: None
+        self.on_job_log = lambda job_id, msg: None
+        self.on_job_metrics = lambda job_id, record: None    # Timings of a finished job, see job_record()
+        self.on_aggregate_progress = lambda value: None      # Mean progress of the current batch
+
+    def enqueue(self, url, save_path, selected_format, selected_codec, download_thumbnail=False, info=None, label=None,
+                **options):
+        with self.lock:
+            job_id = self.next_id
+            self.next_id += 1
+            if self.is_idle():
+                self.batch = []  # Queue was idle, start a fresh batch for the aggregate progress
+                self.batch_progress = 0
+            self.jobs[job_id] = {
+                'args': (url, save_path, selected_format, selected_codec, download_thumbnail, info),
+                'options': options,  # Extra DownloadJob keyword arguments
+                'host': host_key(url),
+                'label': label or url,
+                'progress': 0,
+                'job': None,
+                'connections': 0,  # Connections held while downloading
+                'success': None,
+                'message': None,
+            }
+            self.batch.append(job_id)
+            self.pending.append(job_id)
+            self.on_job_added(job_id, label or url)
+            self.on_job_status(job_id, 'queued')
+            self.schedule()
+            return job_id
+
+    def set_max_concurrent(self, value):
+        with self.lock:
+            self.max_concurrent = max(1, value)
+            self.schedule()
+
+    def set_bandwidth_limit(self, rate):
+        self.bandwidth.set_rate(rate)
+
+    def set_priority(self, priority):
+        with self.lock:
+            self.priority = priority
+            for job_id in self.running | self.postprocessing:
+                self.jobs[job_id]['job'].priority = priority  # Applies from the job's next ffmpeg process
+
+    def encoder_threads(self):
+        return max(1, self.max_encoder_threads // max(1, self.max_postprocess))
+
+    def is_idle(self):
+        return not (self.running or self.pending or self.postprocess_pending or self.postprocessing)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until every queued job has finished. Returns False if the timeout expired first.
+        """
+        with self.idle:
+            return self.idle.wait_for(self.is_idle, timeout)
+
+    def schedule(self):
+        # Called with the lock held
+        while self.postprocess_pending and len(self.postprocessing) < self.max_postprocess:
+            self.start_postprocess(self.postprocess_pending.popleft())
+        # Start pending jobs in order, skipping ones whose host is already at its limit
+        for job_id in list(self.pending):
+            if len(self.running) >= self.max_concurrent or self.connections >= self.max_connections:
+                break
+            if len(self.postprocess_pending) >= self.postprocess_queue_size:
+                break  # Encoders are the bottleneck, don't pile up more downloaded files
+            host = self.jobs[job_id]['host']
+            if sum(1 for j in self.running if self.jobs[j]['host'] == host) >= self.max_per_host:
+                continue
+            self.pending.remove(job_id)
+            self.start_job(job_id)
+        if self.is_idle():
+            self.idle.notify_all()
+
+    def start_job(self, job_id):
+        entry = self.jobs[job_id]
+        job = DownloadJob(*entry['args'], **entry['options'])
+        job.on_log = lambda msg: self.on_job_log(job_id, msg)
+        job.on_progress = lambda value: self.update_progress(job_id, value)
+        job.on_speed = lambda speed, eta: self.on_job_speed(job_id, speed, eta)
+        job.on_finished = lambda success, msg: self.job_finished(job_id, success, msg)
+        job.on_downloaded = lambda: self.job_downloaded(job_id)
+        job.on_connections = lambda count: self.job_connections(job_id, count)
+        job.on_merging = lambda: self.job_merging(job_id)
+        job.bandwidth = self.bandwidth
+        job.encoder_threads = self.encoder_threads()  # Also used when encoding while merging, in a post-processing slot
+        job.priority = self.priority
+        # Split what's left of the budget evenly between this job and the others that could start now
+        startable = min(len(self.pending) + 1, self.max_concurrent - len(self.running))
+        share = (self.max_connections - self.connections) // max(1, startable)
+        job.connections = max(1, min(job.wanted_connections(), share))
+        entry['connections'] = job.connections
+        self.connections += job.connections
+        entry['job'] = job
+        self.running.add(job_id)
+        self.on_job_status(job_id, 'running')
+        threading.Thread(target=job.run, name=f"download-{job_id}", daemon=True).start()
+
+    def update_progress(self, job_id, value):
+        with self.lock:
+            entry = self.jobs[job_id]
+            if entry['progress'] == value:
+                return
+            # Running jobs always belong to the current batch, it is only reset when the queue is idle
+            self.batch_progress += value - entry['progress']
+            entry['progress'] = value
+            self.on_job_progress(job_id, value)
+            aggregate = int(self.batch_progress / len(self.batch))
+            if aggregate != self.aggregate:
+                self.aggregate = aggregate
+                self.on_aggregate_progress(aggregate)
+
+    def job_record(self, job_id):
+        """
+        Returns the outcome and JobMetrics of a finished job as a plain dict.
+        """
+        entry = self.jobs[job_id]
+        return {
+            'job': job_id,
+            'url': entry['args'][0],
+            'label': entry['label'],
+            'success': entry['success'],
+            **entry['job'].metrics.as_dict(),
+        }
+
+    def release_connections(self, job_id):
+        # Called with the lock held
+        self.connections -= self.jobs[job_id]['connections']
+        self.jobs[job_id]['connections'] = 0
+
+    def job_connections(self, job_id, count):
+        with self.lock:
+            entry = self.jobs[job_id]
+            if job_id in self.running and count < entry['connections']:
+                self.connections -= entry['connections'] - count
+                entry['connections'] = count
+                self.schedule()
+
+    def job_downloaded(self, job_id):
+        with self.lock:
+            self.running.discard(job_id)
+            self.release_connections(job_id)
+            self.postprocess_pending.append(job_id)
+            self.on_job_status(job_id, 'waiting')
+            self.schedule()
+
+    def job_merging(self, job_id):
+        """
+        Moves a merge-mode job whose streams are downloaded to the post-processing queue, and
+        blocks its download thread until it gets a slot to encode in.
+        """
+        slot = threading.Event()
+        with self.lock:
+            if job_id not in self.running:
+                return
+            self.running.discard(job_id)
+            self.release_connections(job_id)
+            self.jobs[job_id]['slot'] = slot
+            self.postprocess_pending.append(job_id)
+            self.on_job_status(job_id, 'waiting')
+            self.schedule()
+        slot.wait()
+
+    def start_postprocess(self, job_id):
+        entry = self.jobs[job_id]
+        job = entry['job']
+        self.postprocessing.add(job_id)
+        self.on_job_status(job_id, 'processing')
+        slot = entry.pop('slot', None)
+        if slot:
+            slot.set()  # The encode continues in the merge, on the job's download thread
+            return
+        threading.Thread(target=job.postprocess, name=f"postprocess-{job_id}", daemon=True).start()
+
+    def job_finished(self, job_id, success, msg):
+        with self.lock:
+            if job_id not in self.running and job_id not in self.postprocessing:
+                return
+            self.running.discard(job_id)
+            self.postprocessing.discard(job_id)
+            self.release_connections(job_id)
+            # Info dicts are large, finished jobs only keep their outcome and metrics
+            entry = self.jobs[job_id]
+            entry['args'] = (*entry['args'][:5], None)
+            entry['job'].info = None
+            entry['success'] = success
+            entry['message'] = msg
+            self.on_job_log(job_id, msg)
+            self.on_job_status(job_id, 'done' if success else 'failed')
+            self.on_job_metrics(job_id, self.job_record(job_id))
+            # Failed jobs count as complete for the aggregate progress so it can still reach 100%
+            self.update_progress(job_id, 100)
+            self.schedule()